@@ -0,0 +1,154 @@
+from collections import namedtuple, OrderedDict
+from data.infos_func import get_info_id, get_format_info
+
+import logging
+import re
+
+
+FormatToken = namedtuple("FormatToken", "info_id video_id format_id size status")
+
+# Короткие префиксы callback_data и соответствующие им старые: "yv.2n9c" вместо "yt_video:137:12.5 MB:42"
+CALLBACK_KINDS = {
+    "ya": "yt_audio",
+    "yv": "yt_video",
+    "tv": "tt_download",
+    "ta": "tt_download_audio",
+    "va": "vk_audio",
+    "vv": "vk_video",
+}
+LEGACY_KINDS = {legacy: short for short, legacy in CALLBACK_KINDS.items()}
+
+# Сколько форматов держим в таблице токенов
+TOKEN_TABLE_SIZE = 20000
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number: int) -> str:
+    digits = ""
+    while True:
+        number, rest = divmod(number, 36)
+        digits = BASE36[rest] + digits
+        if not number:
+            return digits
+
+
+def size_with_unit(size):
+    """Размер формата как строка с единицей: TikTok отдавал и хранил число мегабайт без "MB"."""
+    if isinstance(size, (int, float)) or re.fullmatch(r"\d+(?:\.\d+)?", str(size or "").strip()):
+        return f"{str(size).strip()} MB"
+    return size
+
+
+def encode_callback(kind: str, info_id: int) -> str:
+    """
+    Собирает компактный callback_data для кнопки формата.
+
+    Args:
+        kind (str): Старый префикс кнопки, например "yt_video".
+        info_id (int): ID записи Info.
+
+    Returns:
+        str: Строка вида "yv.2n9c" — не длиннее 16 байт при любом format_id.
+    """
+    return f"{LEGACY_KINDS[kind]}.{to_base36(info_id)}"
+
+
+def callback_filter(*kinds: str):
+    """Фильтр для router.callback_query: принимает и компактные токены, и старый формат с ':'."""
+    prefixes = tuple(f"{kind}:" for kind in kinds) + tuple(f"{LEGACY_KINDS[kind]}." for kind in kinds)
+    return lambda call: call.data.startswith(prefixes)
+
+
+class FormatTokenTable:
+    """
+    Таблица форматов в памяти: по ID записи Info из callback_data отдаёт всё, что нужно обработчику скачивания.
+
+    Заполняется при построении клавиатуры, поэтому нажатие кнопки обходится без запросов к базе.
+    Если формата в таблице нет (например, после перезапуска бота), он дочитывается одним запросом.
+    """
+
+    def __init__(self, max_size: int = TOKEN_TABLE_SIZE):
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def remember(self, video_id: int, formats):
+        """
+        Запоминает форматы, показанные на клавиатуре.
+
+        Args:
+            video_id (int): ID видео в базе.
+            formats: Словари с ключами info_id, format_id, filesize, status.
+        """
+        for f in formats:
+            if f.get('info_id') is None:
+                continue
+            self._put(FormatToken(f['info_id'], video_id, f['format_id'], size_with_unit(f.get('filesize')),
+                                  bool(f.get('status'))))
+
+    def mark_ready(self, info_id: int):
+        """Отмечает, что файл формата загружен в Telegram (status = True)."""
+        token = self._tokens.get(info_id)
+        if token is not None:
+            self._tokens[info_id] = token._replace(status=True)
+
+    def _put(self, token: FormatToken):
+        self._tokens[token.info_id] = token
+        self._tokens.move_to_end(token.info_id)
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+
+    async def _load(self, info_id: int, size: str = None):
+        token = self._tokens.get(info_id)
+        if token is not None:
+            self._tokens.move_to_end(info_id)
+            self.hits += 1
+            return token
+        self.misses += 1
+        row = await get_format_info(info_id)
+        if row is None:
+            return None
+        _, video_id, format_id, db_size, status = row
+        token = FormatToken(info_id, video_id, format_id, size_with_unit(size or db_size), bool(status))
+        self._put(token)
+        return token
+
+    async def resolve(self, data: str):
+        """
+        Разбирает callback_data кнопки формата.
+
+        Args:
+            data (str): callback_data — компактный токен или старый формат "kind:format:size:video".
+
+        Returns:
+            tuple: (старый префикс кнопки, FormatToken) или (префикс, None), если формат не найден.
+        """
+        short, dot, encoded = data.partition(".")
+        if dot and short in CALLBACK_KINDS:
+            try:
+                info_id = int(encoded, 36)
+            except ValueError:
+                # Подделанная или испорченная кнопка — как формат, которого нет
+                logging.warning(f"Некорректный токен формата в callback {data}")
+                return CALLBACK_KINDS[short], None
+            return CALLBACK_KINDS[short], await self._load(info_id)
+
+        # Старые клавиатуры, отправленные до перехода на токены
+        try:
+            kind, format_ref, size, video_id = data.split(':')
+            if kind.startswith('vk_'):
+                info_id = int(format_ref)
+            else:
+                info_id = await get_info_id(video_id=int(video_id), format_id=format_ref)
+        except ValueError:
+            logging.warning(f"Некорректный callback формата {data}")
+            return data.split(':')[0], None
+        if info_id is None:
+            logging.warning(f"Формат из callback {data} не найден в базе")
+            return kind, None
+        return kind, await self._load(info_id, size)
+
+
+format_tokens = FormatTokenTable()
@@ -0,0 +1,135 @@
+from aiogram import Bot, types
+from collections import OrderedDict, deque
+from data.files_func import get_telegram_id_by_format_id
+from data.file_index import file_index
+from data.videos_func import get_video
+from rest import EMOJIS, user_messages
+
+import logging
+import emoji
+import time
+
+
+# Сколько подписей держим в памяти
+CAPTION_CACHE_SIZE = 10000
+
+
+class LRU:
+    """Простой LRU-словарь с ограничением по числу записей."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LatencyStats:
+    """Скользящее окно длительностей для p50/p99."""
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+# ID видео -> готовая подпись к файлу
+captions = LRU(CAPTION_CACHE_SIZE)
+fast_path_stats = LatencyStats()
+
+
+def video_caption(video) -> str:
+    return (
+        f"{emoji.emojize(EMOJIS['title'])} Название: {video.name}\n"
+        f"{emoji.emojize(EMOJIS['autor'])} Автор: {video.author}\n\n"
+        f"{emoji.emojize(EMOJIS['durations'])} Длительность: {video.time // 60} мин {video.time % 60} сек\n"
+        f"{emoji.emojize(EMOJIS['date'])} Дата загрузки: {video.date}\n\n"
+    )
+
+
+def remember_bundle(bundle: dict):
+    """Кладёт в кэш подпись видео и file_id уже загруженных форматов из get_video_bundle."""
+    video = bundle["video"]
+    captions.put(video.id, video_caption(video))
+    for f in bundle["audio"] + bundle["video_formats"]:
+        if f["file_id"]:
+            file_index.put(f["info_id"], f["file_id"])
+
+
+async def send_cached(callback_query: types.CallbackQuery, bot: Bot, info_id: int, video_id: int,
+                      is_audio: bool) -> bool:
+    """
+    Отправляет уже загруженный в Telegram файл без скачивания, очереди и состояния downloading.
+
+    file_id берётся из индекса файлов, подпись — из памяти; в базу идём, только если их там нет.
+
+    Args:
+        callback_query (CallbackQuery): Нажатие кнопки формата.
+        bot (Bot): Экземпляр бота.
+        info_id (int): ID записи Info.
+        video_id (int): ID видео в базе.
+        is_audio (bool): Отправлять как аудио.
+
+    Returns:
+        bool: True, если файл отправлен; False — нужно идти обычным путём.
+    """
+    started = time.perf_counter()
+    user_id = callback_query.from_user.id
+
+    file_id = file_index.get(info_id)
+    if file_id is None:
+        file_id = await get_telegram_id_by_format_id(info_id)
+        if not file_id:
+            return False
+        file_index.put(info_id, file_id)
+    caption = captions.get(video_id)
+    if caption is None:
+        video = await get_video(video_id)
+        if video is None:
+            return False
+        caption = video_caption(video)
+        captions.put(video_id, caption)
+
+    try:
+        if is_audio:
+            await callback_query.message.answer_audio(audio=file_id, caption=caption, parse_mode=None)
+        else:
+            await callback_query.message.answer_video(video=file_id, caption=caption, parse_mode=None,
+                                                      supports_streaming=True)
+    except Exception as e:
+        logging.warning(f"Не удалось отправить файл {info_id} из кэша пользователю {user_id}: {e}")
+        return False
+    fast_path_stats.observe(time.perf_counter() - started)
+    logging.info(f"УСПЕХ: Файл {info_id} отправлен из кэша пользователю {user_id} "
+                 f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    # Клавиатура больше не нужна
+    if user_id in user_messages:
+        try:
+            await bot.delete_message(chat_id=user_id, message_id=user_messages.pop(user_id))
+        except Exception as e:
+            logging.warning(f"ОШИБКА: при удалении клавиатуры у {user_id}: {e}")
+    await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
+    return True
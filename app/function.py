@@ -1,167 +1,190 @@
 from aiogram.types import InlineQueryResultArticle, InlineQueryResultVideo, InputTextMessageContent
-from googleapiclient.discovery import build
-from config import YOUTUBE_API_KEY
+from app.youtube_api import youtube, SEARCH_CHANNEL_FIELDS, SEARCH_VIDEO_FIELDS, CHANNEL_FIELDS, QUOTA_COSTS
+from app.search_cache import search_cache, normalize_query
+from config import SEARCH_QUOTA_RESERVE
 from sqlalchemy import select, func
 from datetime import datetime, timedelta
+from contextlib import aclosing
 from database import AsyncSessionLocal
 from data.models import User
-from aiogram.types import BufferedInputFile
-import requests
-from PIL import Image
-from io import BytesIO
 
-# Инициализация API клиента
-api_key = YOUTUBE_API_KEY
-youtube = build("youtube", "v3", developerKey=api_key)
+import asyncio
+import logging
 
 
-async def prepare_image_for_telegram(url: str) -> BufferedInputFile:
-    response = requests.get(url)
-    content_type = response.headers.get("Content-Type", "")
-
-    image_bytes = BytesIO(response.content)
-
-    if "webp" in content_type or url.endswith(".webp"):
-        image = Image.open(image_bytes).convert("RGB")
-        output = BytesIO()
-        image.save(output, format="JPEG")
-        output.seek(0)
-        return BufferedInputFile(output.read(), filename="converted.jpg")
+async def _search_youtube(query, offset=""):
+    # Видео берём больше, но они идут после каналов
+    videos_request = youtube.search(query, type="video", max_results=45, page_token=offset,
+                                    fields=SEARCH_VIDEO_FIELDS)
+    if offset:
+        # Токен страницы относится к поиску видео, канал показываем только на первой странице
+        search_response_channels = {}
+        search_response_videos = await videos_request
     else:
-        image_bytes.seek(0)
-        return BufferedInputFile(image_bytes.read(), filename="original.jpg")
+        # Каналы в приоритете, но ограничим количество; оба запроса выполняются параллельно
+        search_response_channels, search_response_videos = await asyncio.gather(
+            youtube.search(query, type="channel", max_results=1, fields=SEARCH_CHANNEL_FIELDS),
+            videos_request,
+        )
 
-async def search_youtube(query, offset=""):
-    try:
-        # Запрашиваем каналы сначала
-        search_response_channels = youtube.search().list(
-            q=query,
-            part="id,snippet",
-            maxResults=1,  # Каналы в приоритете, но ограничим количество
-            type="channel",
-            pageToken=offset if offset else None
-        ).execute()
-
-        # Запрашиваем видео
-        search_response_videos = youtube.search().list(
-            q=query,
-            part="id,snippet",
-            maxResults=45,  # Видео берём больше, но они идут после каналов
-            type="video",
-            pageToken=offset if offset else None
-        ).execute()
-
-        results = []
-        next_page_token = search_response_videos.get("nextPageToken", "")
-
-        # Добавляем каналы ПЕРВЫМИ в список
-        for item in search_response_channels.get("items", []):
-            channel_id = item["id"]["channelId"]
-            title = item["snippet"]["title"]
-            thumbnail = item["snippet"]["thumbnails"]["high"]["url"]
-
-            results.append(
-                InlineQueryResultArticle(
-                    id=channel_id,
-                    title=f"📺 {title}",
-                    url=f"https://www.youtube.com/channel/{channel_id}",
-                    thumb_url=thumbnail,
-                    description="YouTube канал",
-                    input_message_content=InputTextMessageContent(
-                        message_text=f"https://www.youtube.com/channel/{channel_id}"
-                    )
+    results = []
+    next_page_token = search_response_videos.get("nextPageToken", "")
+
+    # Добавляем каналы ПЕРВЫМИ в список
+    for item in search_response_channels.get("items", []):
+        channel_id = item["id"]["channelId"]
+        title = item["snippet"]["title"]
+        thumbnail = item["snippet"]["thumbnails"]["high"]["url"]
+
+        results.append(
+            InlineQueryResultArticle(
+                id=channel_id,
+                title=f"📺 {title}",
+                url=f"https://www.youtube.com/channel/{channel_id}",
+                thumb_url=thumbnail,
+                description="YouTube канал",
+                input_message_content=InputTextMessageContent(
+                    message_text=f"https://www.youtube.com/channel/{channel_id}"
                 )
             )
+        )
 
-        # Добавляем видео (отфильтровав Shorts)
-        for item in search_response_videos.get("items", []):
-            video_id = item["id"]["videoId"]
-            title = item["snippet"]["title"]
-            description = item["snippet"].get("description", "Нет описания")
-            thumbnail = item["snippet"]["thumbnails"]["high"]["url"]
-
-            # Фильтруем Shorts (по ключевому слову "Shorts" или отсутствию описания)
-            if "shorts" in title.lower() or description == "Нет описания":
-                continue
-
-            results.append(
-                InlineQueryResultVideo(
-                    id=video_id,
-                    title=title,
-                    video_url=f"https://www.youtube.com/watch?v={video_id}",
-                    mime_type="video/mp4",
-                    thumbnail_url=thumbnail,
-                    description=description,
-                    input_message_content=InputTextMessageContent(
-                        message_text=f"https://www.youtube.com/watch?v={video_id}"
-                    )
+    # Добавляем видео (отфильтровав Shorts)
+    for item in search_response_videos.get("items", []):
+        video_id = item["id"]["videoId"]
+        title = item["snippet"]["title"]
+        description = item["snippet"].get("description", "Нет описания")
+        thumbnail = item["snippet"]["thumbnails"]["high"]["url"]
+
+        # Фильтруем Shorts (по ключевому слову "Shorts" или отсутствию описания)
+        if "shorts" in title.lower() or description == "Нет описания":
+            continue
+
+        results.append(
+            InlineQueryResultVideo(
+                id=video_id,
+                title=title,
+                video_url=f"https://www.youtube.com/watch?v={video_id}",
+                mime_type="video/mp4",
+                thumbnail_url=thumbnail,
+                description=description,
+                input_message_content=InputTextMessageContent(
+                    message_text=f"https://www.youtube.com/watch?v={video_id}"
                 )
             )
+        )
+
+    return results, next_page_token
+
+
+async def search_youtube(query, offset=""):
+    """
+    Инлайн-поиск по YouTube (каналы + видео) с кэшем и учётом суточной квоты API.
+
+    Args:
+        query (str): Текст запроса.
+        offset (str): Токен страницы результатов.
+
+    Returns:
+        tuple: (список InlineQueryResult, токен следующей страницы).
+    """
+    query = normalize_query(query)
+    if not query:
+        return [], ""
+    key = (query, offset or "")
+
+    cached = search_cache.get(key)
+    if cached is not None:
+        search_cache.hits += 1
+        return cached
 
-        return results, next_page_token
+    # Первая страница — два запроса search (каналы + видео), следующие — один
+    cost = QUOTA_COSTS["search"] * (1 if offset else 2)
+    if not youtube.quota.can_spend(cost, reserve=SEARCH_QUOTA_RESERVE):
+        logging.warning(f"Квота YouTube API почти исчерпана ({youtube.quota.used} ед.), поиск '{query}' не выполнен")
+        return search_cache.get(key, allow_stale=True) or ([], "")
 
+    try:
+        return await search_cache.load(key, lambda: _search_youtube(query, offset))
     except Exception as e:
         print(f"Ошибка при запросе к YouTube API: {e}")
         return [], ""
 
 
-async def get_channel_videos(channel_id):
-    try:
-        # Получаем информацию о канале
-        request = youtube.channels().list(
-            part="snippet,contentDetails,statistics",
-            id=channel_id
-        )
-        response = request.execute()
+async def get_uploads_playlist_id(channel_id: str):
+    """
+    Возвращает ID плейлиста загрузок канала.
 
-        if not response.get("items"):
-            return None, "Канал не найден"
+    Для обычных каналов (UC...) плейлист загрузок — это тот же ID с префиксом UU, запрос к API не нужен.
+    """
+    if channel_id.startswith("UC"):
+        return "UU" + channel_id[2:]
+    response = await youtube.channels(channel_id=channel_id, part="contentDetails",
+                                      fields="items(contentDetails/relatedPlaylists/uploads)")
+    if not response.get("items"):
+        return None
+    return response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
 
-        channel = response["items"][0]
-        channel_name = channel["snippet"]["title"]
-        channel_avatar = channel["snippet"]["thumbnails"]["high"]["url"]
-        subscribers_count = format_number(channel["statistics"].get("subscriberCount", 0))
-        video_count = format_number(channel["statistics"].get("videoCount", 0))
 
-        # Получаем плейлист с загруженными видео
-        uploads_playlist_id = channel["contentDetails"]["relatedPlaylists"]["uploads"]
+async def iter_playlist_pages(playlist_id: str, page_token: str = None, page_size: int = 20):
+    """
+    Асинхронный генератор по страницам плейлиста.
+
+    Следующая страница запрашивается только тогда, когда потребитель её попросил, поэтому для показа
+    одной страницы инлайн-выдачи выполняется ровно один запрос к API.
+
+    Args:
+        playlist_id (str): ID плейлиста.
+        page_token (str): Токен страницы, с которой начинать.
+        page_size (int): Размер страницы (не больше 50).
 
-        # Получаем список видео
+    Yields:
+        tuple: (список видео, токен следующей страницы или "").
+    """
+    while True:
+        response = await youtube.playlist_items(playlist_id, max_results=page_size, page_token=page_token)
         videos = []
-        next_page_token = None
-
-        while True:
-            playlist_request = youtube.playlistItems().list(
-                part="snippet",
-                playlistId=uploads_playlist_id,
-                maxResults=50,
-                pageToken=next_page_token if next_page_token else None
-            )
-            playlist_response = playlist_request.execute()
-
-            for item in playlist_response.get("items", []):
-                video_id = item["snippet"]["resourceId"]["videoId"]
-                title = item["snippet"]["title"]
-                thumbnail = item["snippet"]["thumbnails"]["high"]["url"]
-
-                videos.append({
-                    "id": video_id,
-                    "title": title,
-                    "thumbnail": thumbnail,
-                    "url": f"https://www.youtube.com/watch?v={video_id}"
-                })
-
-            next_page_token = playlist_response.get("nextPageToken")
-            if not next_page_token:
-                break  # Если видео закончились — выходим
-
-        return {
-            "channel_name": channel_name,
-            "channel_avatar": channel_avatar,
-            "subscribers": subscribers_count,
-            "video_count": video_count,
-            "videos": videos
-        }
+        for item in response.get("items", []):
+            video_id = item["snippet"]["resourceId"]["videoId"]
+            videos.append({
+                "id": video_id,
+                "title": item["snippet"]["title"],
+                "channel_name": item["snippet"].get("channelTitle", ""),
+                "thumbnail": item["snippet"].get("thumbnails", {}).get("high", {}).get("url", ""),
+                "url": f"https://www.youtube.com/watch?v={video_id}"
+            })
+        page_token = response.get("nextPageToken", "")
+        yield videos, page_token
+        if not page_token:
+            break  # Если видео закончились — выходим
+
+
+async def get_channel_videos(channel_id, offset: str = "", limit: int = 20):
+    """
+    Возвращает одну страницу видео канала для инлайн-выдачи.
+
+    Args:
+        channel_id (str): ID канала.
+        offset (str): Инлайн-offset от Telegram — токен страницы плейлиста загрузок.
+        limit (int): Количество видео на странице.
+
+    Returns:
+        dict | None: {"channel_name", "videos", "next_offset"} или None при ошибке.
+    """
+    try:
+        uploads_playlist_id = await get_uploads_playlist_id(channel_id)
+        if not uploads_playlist_id:
+            return None
+
+        # Нужна одна страница: генератор закрываем сразу, а не оставляем сборщику мусора
+        async with aclosing(iter_playlist_pages(uploads_playlist_id, offset or None, limit)) as pages:
+            async for videos, next_page_token in pages:
+                return {
+                    "channel_name": videos[0]["channel_name"] if videos else "",
+                    "videos": videos,
+                    "next_offset": next_page_token
+                }
+        return None
 
     except Exception as e:
         print(f"Ошибка при получении видео канала: {e}")
@@ -178,8 +201,7 @@ async def get_channel_info(url: str):
         # Пример: https://www.youtube.com/c/YourChannelName
         channel_name = url.split("youtube.com/c/")[-1]
         # Запрашиваем канал по имени
-        request = youtube.channels().list(part="id", forUsername=channel_name)
-        response = request.execute()
+        response = await youtube.channels(for_username=channel_name, part="id", fields="items(id)")
         if response.get("items"):
             channel_id = response["items"][0]["id"]
 
@@ -187,11 +209,7 @@ async def get_channel_info(url: str):
         return "Не удалось извлечь ID канала"
 
     # Запрос к YouTube API для получения информации о канале
-    request = youtube.channels().list(
-        part="snippet,contentDetails,statistics",
-        id=channel_id
-    )
-    response = request.execute()
+    response = await youtube.channels(channel_id=channel_id, fields=CHANNEL_FIELDS)
 
     # Обработка ответа от API
     if response.get("items"):
@@ -1,20 +1,35 @@
 from rest import EMOJIS, ERROR_TEXT, ERROR_IMAGE, LOAD_IMAGE, START_IMAGE, FAILS_IMAGE, YOUTUBE_REGEX,\
                         YOUTUBE_CHANNEL_REGEX, TIKTOK_REGEX, INFO_MESSAGE, VK_VIDEO_REGEX, is_under_2gb,\
                                                                     user_messages, delete_keyboard_message, is_playlist_url, convert_size_to_bytes
-from yout import sanitize_filename, get_video_info, filter_best_formats, convert_webm_to_m4a,\
-                                                              download_and_merge_by_format
+from yout import sanitize_filename, get_video_info, filter_best_formats, remux_audio,\
+                                                              download_and_merge_by_format, download_audio_by_format
 from vk import get_vk_video_info, get_formats_vk_video, download_vk_video_async
 from tik import get_tiktok_video_info, download_tiktok_video, get_tiktok_video_details, create_caption
+from download_queue import download_queue, PRIORITY_CACHED, PRIORITY_AUDIO, PRIORITY_VIDEO
+from single_flight import single_flight
 from app.keyboards import main_kb, make_keyboard_vk, main_kb_tt, find_yt_kb, all_videos_channel, main_menu
 from app.states import DownloadState
+from app.middlewares import DbSessionMiddleware
+from url_canon import resolve_video_key, canonical_url
+from app.callback_tokens import format_tokens, callback_filter
+from app.fast_path import send_cached, remember_bundle, fast_path_stats, video_caption
+from stream_upload import stream_video_to_chat, STREAM_ENABLED
+from staging import staging
+from ffmpeg_runner import ffmpeg_runner
+from data.file_index import file_index
 from aiogram import Router, Bot, types, exceptions, F
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import CommandStart
-from app.function import search_youtube, get_channel_info, get_channel_videos, get_user_statistics, prepare_image_for_telegram
+from app.function import search_youtube, get_channel_info, get_channel_videos, get_user_statistics
+from app.thumbnails import prepare_image_for_telegram, remember_thumbnail
+from app.youtube_api import youtube
+from app.search_cache import search_cache
+from app.inline_debounce import inline_debouncer
 from aiogram.types import FSInputFile, Message
 from aiogram.filters import Command
 from datetime import datetime
 from aiogram.types import InlineQueryResultVideo, InputTextMessageContent
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from dotenv import load_dotenv
@@ -27,14 +42,16 @@ import os
 
 from data.channels_func import create_or_update_channel
 from data.files_func import create_file, get_telegram_id_by_format_id
-from data.infos_func import create_info, get_info_id, update_info_status, get_audio_info, get_info_by_video_and_format, get_status_by_id, get_format_id_by_id, get_formats_by_video_id, get_video_formats
+from data.infos_func import create_infos, update_info_status, get_info_by_video_and_format
 
 from data.users_func import create_user, get_user, increment_yt_count, increment_vk_count, increment_tt_count
-from data.videos_func import create_video, get_video_by_url, is_video_in_db, get_video, update_video_thumbnail
+from data.videos_func import create_video, get_video_bundle, get_video, update_video_thumbnail, get_video_thumbnail
 
 
 
 router = Router()
+# Одна сессия БД и один коммит на каждое входящее сообщение
+router.message.middleware(DbSessionMiddleware())
 
 state_storage = {}
 
@@ -67,9 +84,9 @@ async def search(message: Message):
     )
 
 @router.message(F.text == "👤 Профиль")
-async def profile(message: Message):
+async def profile(message: Message, session: AsyncSession):
     user_id = message.from_user.id
-    user = await get_user(user_id)
+    user = await get_user(user_id, session=session)
     days = (datetime.utcnow() - user.login_time).days
     msg = f"👋 Привет, {user.username or 'пользователь'}!\n"
     msg += f"🗓 Ты пользуешься нашим ресурсом уже {days} дней.\n"
@@ -90,11 +107,26 @@ async def help_info(message: Message):
 @router.message(Command("admin"))
 async def admin_handler(message: types.Message):
     total, active = await get_user_statistics()
-    await message.answer(f"👥 Всего пользователей: {total}\n🕒 Активных за 24 часа: {active}")
+    queue = download_queue.stats()
+    disk = staging.stats()
+    ffmpeg = ffmpeg_runner.stats()
+    await message.answer(f"👥 Всего пользователей: {total}\n🕒 Активных за 24 часа: {active}\n\n"
+                         f"📥 В очереди: {queue['queued']} (быстрых: {queue['fast_queued']}), в работе: {queue['running']}\n"
+                         f"⏱ Ожидание: среднее {queue['wait_avg']:.1f} с, p95 {queue['wait_p95']:.1f} с, "
+                         f"макс {queue['wait_max']:.1f} с\n"
+                         f"✅ Выполнено: {queue['processed']}, ошибок: {queue['failed']}\n\n"
+                         f"🔑 Квота YouTube API: {youtube.quota.used}/{youtube.quota.daily_limit}\n"
+                         f"🔍 Кэш поиска: попаданий {search_cache.hits}, промахов {search_cache.misses}\n"
+                         f"⚡ Отправок из кэша: {fast_path_stats.count}, p50 {fast_path_stats.percentile(0.5) * 1000:.0f} мс, "
+                         f"p99 {fast_path_stats.percentile(0.99) * 1000:.0f} мс, файлов в индексе: {len(file_index)}\n"
+                         f"💾 Резерв на диске: {disk['reserved'] // 1024 ** 2} MB ({disk['active']} загрузок), "
+                         f"свободно {disk['free'] / 1024 ** 3:.1f} GB, отказов {disk['refused']}\n"
+                         f"🎞 ffmpeg: {ffmpeg['running']}/{ffmpeg['limit']}, ждут {ffmpeg['waiting']}, "
+                         f"выполнено {ffmpeg['completed']}, ошибок {ffmpeg['failed']}")
 
 
 @router.message(lambda message: re.search(YOUTUBE_CHANNEL_REGEX, message.text, re.IGNORECASE))
-async def youtube_channel_handler(message: types.Message, state: FSMContext, bot: Bot):
+async def youtube_channel_handler(message: types.Message, state: FSMContext, bot: Bot, session: AsyncSession):
     url = message.text.strip()
     user_id = message.from_user.id
 
@@ -114,13 +146,13 @@ async def youtube_channel_handler(message: types.Message, state: FSMContext, bot
     )
     file_id = give.photo[-1].file_id  # Обычно последний — самый большой по качеству
     await create_or_update_channel(channel_id=str(channel_id), channel_name=channel_name,
-                                   channel_avatar=file_id, subscribers_count=subscribers_count, video_count=video_count
-                                   )
+                                   channel_avatar=file_id, subscribers_count=subscribers_count, video_count=video_count,
+                                   session=session)
 
 
 
 @router.message(lambda message: re.search(YOUTUBE_REGEX, message.text, re.IGNORECASE))
-async def youtube_handler(message: types.Message, state: FSMContext, bot: Bot):
+async def youtube_handler(message: types.Message, state: FSMContext, bot: Bot, session: AsyncSession):
     url = message.text.strip()
     user_id = message.from_user.id
     username = message.from_user.username
@@ -138,43 +170,67 @@ async def youtube_handler(message: types.Message, state: FSMContext, bot: Bot):
     try:
         msg_info = await message.reply_photo(photo=LOAD_IMAGE, caption=emoji.emojize(EMOJIS['wait']) + INFO_MESSAGE)
 
-        user = await create_user(telegram_id=user_id, username=username)
-
-        if await is_video_in_db(url):
-            videofile = await get_video_by_url(url)
+        video_key = await resolve_video_key(url)
+        if video_key:
+            # Все варианты ссылки (youtu.be, m.youtube.com, shorts, &t=) сводим к одной
+            url = canonical_url(*video_key)
+        bundle = await get_video_bundle(url, video_key, session=session)
+        if bundle:
+            remember_bundle(bundle)
+            videofile = bundle["video"]
             video = videofile.id
             title = videofile.name
             thumbnail = videofile.thumbnail
-            audio_id, a_size = await get_audio_info(video)
-            audio_size = await convert_size_to_bytes(a_size)
-            filtered_formats = await get_video_formats(videofile.id)
+            audio = bundle["audio"][0] if bundle["audio"] else {}
+            audio_id, audio_status, audio_info_id = audio.get("format_id"), audio.get("status"), audio.get("info_id")
+            audio_size = await convert_size_to_bytes(audio.get("filesize"))
+            filtered_formats = bundle["video_formats"]
             new = False
         else:
+            # Пока yt-dlp получает информацию, соединение с базой не держим: в транзакции ещё только чтение
+            await session.rollback()
             audio_id, audio_size, title, image, info, video_id, channel_id, channel_name = await get_video_info(url)
             title_sanitaze = await sanitize_filename(title)
-            thumbnail = await prepare_image_for_telegram(image)
-            channel = await create_or_update_channel(channel_id=channel_id, channel_name=channel_name, channel_avatar=None, subscribers_count=None, video_count=None)
-            video = await create_video(youtube_id=video_id, name=title_sanitaze, author=channel_name, url=url, channel_id=channel, time=info.get("duration"), date=info.get("upload_date"))
-            new = True
+            # Миниатюра могла быть отправлена раньше (видео сохранено под другой ссылкой) — берём её file_id
+            stored_thumbnail = await get_video_thumbnail(video_id, url, session=session)
+            thumbnail = await prepare_image_for_telegram(image, stored_thumbnail)
+            channel = await create_or_update_channel(channel_id=channel_id, channel_name=channel_name, channel_avatar=None, subscribers_count=None, video_count=None, session=session)
+            video = await create_video(youtube_id=video_id, name=title_sanitaze, author=channel_name, url=url, channel_id=channel, time=info.get("duration"), date=info.get("upload_date"), session=session)
+            new = stored_thumbnail is None
 
             if not info:
                 await message.reply(text=emoji.emojize(EMOJIS['warning']) + "Не удалось найти доступные форматы для этого видео.")
                 logging.info(f"Нет доступных форматов для {video_id}")
+                await session.rollback()
                 return
 
             filtered_formats = await filter_best_formats(info.get("formats", []), video_id)
-            await create_info(video_id=video, format_id=audio_id, type='Audio', size=f'{round(audio_size / (1024 ** 2), 2)} MB')
+            formats = [{"format_id": audio_id, "type": 'Audio', "size": f'{round(audio_size / (1024 ** 2), 2)} MB'}]
+            formats += [{"format_id": f['format_id'], "type": 'Video', "resolution": f['resolution'], "size": f['filesize']}
+                        for f in filtered_formats]
+            info_ids = await create_infos(video, formats, session=session)
+            audio_status, audio_info_id = False, info_ids.get(audio_id)
             for f in filtered_formats:
-                await create_info(video_id=video, format_id=f['format_id'], type='Video', resolution=f['resolution'], size=f['filesize'])
+                f['info_id'] = info_ids.get(f['format_id'])
+
+        user = await create_user(telegram_id=user_id, username=username, session=session)
+        # Фиксируем записи до обращений к Telegram, чтобы не держать соединение и блокировки строк
+        await session.commit()
 
+        # Форматы регистрируем в таблице токенов здесь, где они загружены: сборка клавиатуры ничего не меняет,
+        # а нажатие кнопки не ходит в базу
+        format_tokens.remember(video, [{"info_id": audio_info_id, "format_id": audio_id, "status": audio_status,
+                                        "filesize": f'{round(audio_size / (1024 ** 2), 2)} MB'}, *filtered_formats])
         msg_keyboard = await message.answer_photo(
             photo=thumbnail,
             caption=f"Видео: {title}\n\n {emoji.emojize(EMOJIS['tv'])} Выберите формат для скачивания:",
-            reply_markup=await main_kb(filtered_formats, audio_id, audio_size, video)
+            reply_markup=main_kb(filtered_formats, audio_id, audio_size, video, audio_status, audio_info_id)
         )
         if new:
             telegram_photo_id = msg_keyboard.photo[-1].file_id#
-            await update_video_thumbnail(video, telegram_photo_id)
+            await update_video_thumbnail(video, telegram_photo_id, session=session)
+            await session.commit()
+            remember_thumbnail(image, telegram_photo_id)
 
         user_messages[user_id] = msg_keyboard.message_id
         logging.info(f"Клавиатура сформированна и отправлена пользователю {user_id}")
@@ -182,6 +238,9 @@ async def youtube_handler(message: types.Message, state: FSMContext, bot: Bot):
 
     except Exception as e:
         logging.error(f"ОШИБКА процесса обработки ссылки на Youtube от пользователя {user_id}: - {e}")
+        # Хэндлер гасит ошибку сам, поэтому недописанные записи (видео без форматов и т.п.) откатываем здесь:
+        # иначе их зафиксировал бы коммит DbSessionMiddleware
+        await session.rollback()
         await message.reply_photo(photo=ERROR_IMAGE, caption=ERROR_TEXT)
         await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
         if 'msg_info' in locals():
@@ -189,7 +248,7 @@ async def youtube_handler(message: types.Message, state: FSMContext, bot: Bot):
 
 
 @router.message(lambda message: re.search(TIKTOK_REGEX, message.text, re.IGNORECASE))
-async def tiktok_handler(message: types.Message, bot: Bot):
+async def tiktok_handler(message: types.Message, bot: Bot, session: AsyncSession):
     url = message.text.strip()
     user_id = message.from_user.id
     username = message.from_user.username
@@ -198,53 +257,72 @@ async def tiktok_handler(message: types.Message, bot: Bot):
     if delete_keyboard_message(user_id):
         await bot.delete_message(chat_id=user_id, message_id=user_messages[user_id])
         del user_messages[user_id]
-    if '/video/' not in url:
-        raise ValueError("❌ Поддерживаются только видео TikTok, а не фото.")
-        await message.answer(text="❌ Поддерживаются только видео TikTok, а не фото.")
-        await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
-        return
 
     try:
         msg_info = await message.reply_photo(photo=LOAD_IMAGE, caption=emoji.emojize(EMOJIS['wait']) + INFO_MESSAGE)
-        user = await create_user(telegram_id=user_id, username=username)
-        if await is_video_in_db(url):
-            videofile = await get_video_by_url(url)
+        # Короткие ссылки vm.tiktok.com, vt.tiktok.com и tiktok.com/t/ раскрываются до ссылки на видео
+        video_key = await resolve_video_key(url)
+        if not video_key:
+            # Ссылка не ведёт на видео (например, фото-пост)
+            await msg_info.delete()
+            await message.answer(text="❌ Поддерживаются только видео TikTok, а не фото.")
+            await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
+            return
+        # Ссылки с параметрами и раскрытые короткие ссылки сводим к одной
+        url = canonical_url(*video_key)
+        bundle = await get_video_bundle(url, video_key, session=session)
+        if bundle:
+            remember_bundle(bundle)
+            videofile = bundle["video"]
             video = videofile.id
             title = videofile.name
             thumbnail = videofile.thumbnail
-            format_id = await get_video_formats(video)
+            format_id = bundle["video_formats"]
             new = False
         else:
+            # Пока yt-dlp получает информацию, соединение с базой не держим: в транзакции ещё только чтение
+            await session.rollback()
             info, video_id, title_, author, channel_id, duration, upload_date, thumbnail_url = await get_tiktok_video_info(url)
             format_id = await get_tiktok_video_details(info)
             title = await sanitize_filename(title_)
-            thumbnail = await prepare_image_for_telegram(thumbnail_url)
+            stored_thumbnail = await get_video_thumbnail(video_id, url, session=session)
+            thumbnail = await prepare_image_for_telegram(thumbnail_url, stored_thumbnail)
 
-            channel = await create_or_update_channel(channel_id=channel_id, channel_name=author, channel_avatar=None, subscribers_count=None, video_count=None)
+            channel = await create_or_update_channel(channel_id=channel_id, channel_name=author, channel_avatar=None, subscribers_count=None, video_count=None, session=session)
             video = await create_video(youtube_id=video_id, name=title, author=author, url=url,
-                                   channel_id=channel_id, time=duration, date=upload_date)
-            new = True
+                                   channel_id=channel_id, time=duration, date=upload_date, session=session)
+            new = stored_thumbnail is None
+            info_ids = await create_infos(video, [
+                {"format_id": f['format_id'], "type": 'Video', "resolution": f['resolution'], "size": str(f['filesize'])}
+                for f in format_id if f['filesize'] != 0
+            ], session=session)
             for f in format_id:
-                if f['filesize'] == 0:
-                    continue
-                await create_info(video_id=video, format_id=f['format_id'], type='Video', resolution=f['resolution'], size=str(f['filesize']))
+                f['info_id'] = info_ids.get(f['format_id'])
 
             logging.info(f"Данные от пользователя {user_id} сохранены в базе данных")
 
+        user = await create_user(telegram_id=user_id, username=username, session=session)
+        # Фиксируем записи до обращений к Telegram, чтобы не держать соединение и блокировки строк
+        await session.commit()
+
+        format_tokens.remember(video, format_id)
         msg_keyboard = await message.reply_photo(
             photo=thumbnail,
             caption=f"Видео: {title}\n\n {emoji.emojize(EMOJIS['tv'])} Выберите формат для скачивания:",
-            reply_markup=await main_kb_tt(format_id, video)
+            reply_markup=main_kb_tt(format_id, video)
         )
         if new:
             telegram_photo_id = msg_keyboard.photo[-1].file_id
-            await update_video_thumbnail(video, telegram_photo_id)
+            await update_video_thumbnail(video, telegram_photo_id, session=session)
+            await session.commit()
+            remember_thumbnail(thumbnail_url, telegram_photo_id)
 
         user_messages[user_id] = msg_keyboard.message_id
         logging.info(f"Клавиатура сформирована и отправлена пользователю {user_id}")
         await msg_info.delete()
     except Exception as e:
         logging.error(f"ОШИБКА процесса обработки ссылки на TikTok от пользователя {user_id}: - {e}")
+        await session.rollback()
         await message.reply_photo(photo=ERROR_IMAGE, caption=ERROR_TEXT)
         await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
         if 'msg_info' in locals():
@@ -252,7 +330,7 @@ async def tiktok_handler(message: types.Message, bot: Bot):
 
 
 @router.message(lambda message: re.search(VK_VIDEO_REGEX, message.text, re.IGNORECASE))
-async def vk_video_handler(message: types.Message, state: FSMContext, bot: Bot):
+async def vk_video_handler(message: types.Message, state: FSMContext, bot: Bot, session: AsyncSession):
     url = message.text.strip()
     user_id = message.from_user.id
     username = message.from_user.username
@@ -264,42 +342,57 @@ async def vk_video_handler(message: types.Message, state: FSMContext, bot: Bot):
 
     try:
         msg_info = await message.reply_photo(photo=LOAD_IMAGE, caption=emoji.emojize(EMOJIS['wait']) + INFO_MESSAGE)
-        user = await create_user(telegram_id=user_id, username=username)
-        if await is_video_in_db(url):
-            videofile = await get_video_by_url(url)
+        # Ссылку VK не переписываем: в ней могут быть параметры доступа к видео
+        video_key = await resolve_video_key(url)
+        bundle = await get_video_bundle(url, video_key, session=session)
+        if bundle:
+            remember_bundle(bundle)
+            videofile = bundle["video"]
             video = videofile.id
             title = videofile.name
             thumbnail = videofile.thumbnail
-            format_id = await get_formats_by_video_id(video)
+            # Аудио первыми, затем видео по возрастанию разрешения
+            format_id = bundle["audio"] + bundle["video_formats"]
             new = False
         else:
+            # Пока yt-dlp получает информацию, соединение с базой не держим: в транзакции ещё только чтение
+            await session.rollback()
             video_vk_info, author, image, video_id, duration, channel_id, upload_date = await get_vk_video_info(url)
             print(video_vk_info)
             format_id = await get_formats_vk_video(video_vk_info)
             title = await sanitize_filename(video_vk_info['title'])
-            thumbnail = await prepare_image_for_telegram(image)
+            stored_thumbnail = await get_video_thumbnail(video_id, url, session=session)
+            thumbnail = await prepare_image_for_telegram(image, stored_thumbnail)
 
-            channel = await create_or_update_channel(channel_id=channel_id, channel_name=author, channel_avatar=None, subscribers_count=None, video_count=None)
+            channel = await create_or_update_channel(channel_id=channel_id, channel_name=author, channel_avatar=None, subscribers_count=None, video_count=None, session=session)
             video = await create_video(youtube_id=video_id, name=title, author=author, url=url,
-                                   channel_id=channel_id, time=duration, date=upload_date)
-            new = True
+                                   channel_id=channel_id, time=duration, date=upload_date, session=session)
+            new = stored_thumbnail is None
+            info_ids = await create_infos(video, [
+                {"format_id": f['format_id'], "type": 'Audio' if f['resolution'] == 'audio' else 'Video',
+                 "resolution": f['resolution'], "size": str(f['filesize'])}
+                for f in format_id
+            ], session=session)
             for f in format_id:
-                if f['resolution'] == 'audio':
-                    type = 'Audio'
-                else:
-                    type = 'Video'
-                await create_info(video_id=video, format_id=f['format_id'], type=type, resolution=f['resolution'], size=str(f['filesize']))
+                f['info_id'] = info_ids.get(f['format_id'])
 
             logging.info(f"Данные от пользователя {user_id} сохранены в базе данных")
 
+        user = await create_user(telegram_id=user_id, username=username, session=session)
+        # Фиксируем записи до обращений к Telegram, чтобы не держать соединение и блокировки строк
+        await session.commit()
+
+        format_tokens.remember(video, format_id)
         msg_keyboard = await message.reply_photo(
             thumbnail,
             caption=f"Видео: {title}\n\n {emoji.emojize(EMOJIS['tv'])} Выберите формат для скачивания:",
-            reply_markup=await make_keyboard_vk(format_id, video)
+            reply_markup=make_keyboard_vk(format_id, video)
         )
         if new:
             telegram_photo_id = msg_keyboard.photo[-1].file_id
-            await update_video_thumbnail(video, telegram_photo_id)
+            await update_video_thumbnail(video, telegram_photo_id, session=session)
+            await session.commit()
+            remember_thumbnail(image, telegram_photo_id)
 
 
         user_messages[user_id] = msg_keyboard.message_id
@@ -308,6 +401,7 @@ async def vk_video_handler(message: types.Message, state: FSMContext, bot: Bot):
 
     except Exception as e:
         logging.error(f"ОШИБКА процесса обработки ссылки на VK video от пользователя {user_id}: - {e}")
+        await session.rollback()
         await message.reply_photo(photo=ERROR_IMAGE, caption=ERROR_TEXT)
         await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
         if 'msg_info' in locals():
@@ -315,25 +409,33 @@ async def vk_video_handler(message: types.Message, state: FSMContext, bot: Bot):
 
 
 @router.message()  # Этот хэндлер сработает, если ни один другой не подошёл
-async def handle_invalid_message(message: types.Message, bot: Bot):
+async def handle_invalid_message(message: types.Message, bot: Bot, session: AsyncSession):
     user_id = message.from_user.id
     username = message.from_user.username
     if delete_keyboard_message(user_id):
         await bot.delete_message(chat_id=user_id, message_id=user_messages[user_id])
         del user_messages[user_id]
     logging.info(f"Сообщение в неправильном формате получено от пользователя {user_id} ***FAILED_LINK***")
-    user = await create_user(telegram_id=user_id, username=username)
+    user = await create_user(telegram_id=user_id, username=username, session=session)
+    await session.commit()
     await message.answer_photo(photo=FAILS_IMAGE, caption="❌ Неправильный формат ссылки. Отправьте корректную ссылку на видео.")
 
 
-@router.callback_query(lambda call: call.data.startswith('yt_video:') or call.data.startswith('yt_audio:'))
+@router.callback_query(callback_filter('yt_video', 'yt_audio'))
 async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state: FSMContext):
-    format_id = callback_query.data.split(':')[1]
+    kind, token = await format_tokens.resolve(callback_query.data)
+    if token is None:
+        await callback_query.answer("Формат не найден, отправьте ссылку ещё раз.", show_alert=True)
+        return
+    info_id, video_id, format_id, file_size_id, status = token
+    is_audio = kind == 'yt_audio'
     user_id = callback_query.from_user.id
-    file_size_id = callback_query.data.split(':')[2]
-    video_id = int(callback_query.data.split(':')[3])
-    info_id = await get_info_id(video_id=video_id, format_id=format_id)
-    status = await get_status_by_id(info_id)
+    # Файл уже есть в Telegram — отправляем сразу, без очереди и состояния скачивания
+    if status and await send_cached(callback_query, bot, info_id, video_id, is_audio):
+        return
+    flight_key = (video_id, format_id)
+    is_leader, shared_file_id, id_telegram = False, None, None
+    reservation = None
 
     # Устанавливаем состояние "downloading"
     await state.set_state(DownloadState.downloading)
@@ -359,11 +461,33 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                     logging.info(f"УСПЕХ: Сообщение с клавиатурой скрыто у пользователя {user_id}, скачивание началось")
                 except Exception as e:
                     logging.warning(f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
+            # Если этот же файл прямо сейчас качает другой пользователь — ждём его и берём готовый file_id
             if status == False:
+                is_leader, shared_file_id = await single_flight.join(flight_key)
+                if shared_file_id:
+                    status = True
+            if status == False and STREAM_ENABLED and not is_audio:
+                video = await get_video(video_id)
+                try:
+                    id_telegram = await download_queue.submit(user_id, stream_video_to_chat, bot, video, format_id,
+                                                              callback_query.message.chat.id, video_caption(video))
+                except Exception as e:
+                    logging.warning(f"Потоковая отправка {video_id} ({format_id}) не удалась, качаю на диск: {e}")
+            if id_telegram:
+                await create_file(video_id=video_id, format_id=info_id, id_telegram=id_telegram)
+                await update_info_status(id=info_id)
+                format_tokens.mark_ready(info_id)
+                await increment_yt_count(user_id)
+            elif status == False:
                 video = await get_video(video_id)
                 # Скачивание видео
-                output_file, video_info = await download_and_merge_by_format(video, format_id)
-                format_get = await get_info_id(video_id=video_id, format_id=format_id)
+                priority = PRIORITY_AUDIO if is_audio else PRIORITY_VIDEO
+                reservation = await staging.reserve(file_size_id)
+                # Для аудио качается только аудиодорожка, которая затем перекладывается в m4a без перекодирования
+                download = download_audio_by_format if is_audio else download_and_merge_by_format
+                output_file, video_info = await download_queue.submit(user_id, download, video,
+                                                                      format_id, priority=priority)
+                format_get = info_id
                 if output_file == None:
                     await callback_query.message.reply(
                         text=emoji.emojize(EMOJIS['warning']) + "Данное видео скорее всего заблокировано в вашем регионе.",
@@ -373,12 +497,6 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                     return
                 logging.info(f"УСПЕХ: Видео для пользователя {user_id} УСПЕШНО СКАЧАНО {output_file}")
 
-                # Проверка и конвертация аудио
-                if callback_query.data.startswith('yt_audio'):
-                    if output_file.endswith('.webm'):
-                        output_file = await convert_webm_to_m4a(output_file)
-                        logging.info(f"УСПЕХ: Аудио файл полученный от пользователя {user_id}: {output_file} переконвертировался в M4A")
-
                 # Проверка размера файла
                 file_size = os.path.getsize(output_file)
                 if file_size > 2 * 1024 * 1024 * 1024:  # 2 GB
@@ -387,8 +505,7 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                         disable_web_page_preview=True
                     )
                     logging.warning(f"ОШИБКА: {output_file} файл слишком большой ({file_size} byte) для пользователя {user_id}")
-                    os.remove(output_file)
-                    logging.info(f"Файл {output_file} УДАЛЕН! ")
+                    staging.discard(output_file, keep=False)
                     return
 
                 # Обработка даты
@@ -412,7 +529,7 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                     )
 
                 # Отправка пользователю
-                if callback_query.data.startswith('yt_audio'):
+                if is_audio:
                     if user_id in user_messages:
                         try:
                             await bot.edit_message_caption(
@@ -462,14 +579,17 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                     except Exception as e:
                         logging.error(f"ОШИБКА: файл не удалось ОТПРАВИТЬ {user_id}: {e}")
 
+                if not id_telegram:
+                    # Отправка не удалась: формат не помечаем загруженным, иначе в базе останется пустой file_id
+                    staging.discard(output_file, keep=False)
+                    raise RuntimeError(f"файл {output_file} не отправлен в Telegram")
                 file_id = await create_file(video_id=video_id, format_id=format_get, id_telegram=id_telegram)
                 info = await update_info_status(id=format_get)
+                format_tokens.mark_ready(format_get)
                 await increment_yt_count(user_id)
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                    logging.info(f"УСПЕХ: Файл {output_file} УДАЛЕН! ")
+                staging.discard(output_file)
             else:
-                output_file = await get_telegram_id_by_format_id(info_id)
+                output_file = shared_file_id or await get_telegram_id_by_format_id(info_id)
                 video = await get_video(video_id)
                 caption = (
                     f"{emoji.emojize(EMOJIS['title'])} Название: {video.name}\n"
@@ -477,7 +597,7 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                     f"{emoji.emojize(EMOJIS['durations'])} Длительность: {video.time // 60} мин {video.time % 60} сек\n"
                     f"{emoji.emojize(EMOJIS['date'])} Дата загрузки: {video.date}\n\n"
                     )
-                if callback_query.data.startswith('yt_audio'):
+                if is_audio:
                     if user_id in user_messages:
                         try:
                             await bot.edit_message_caption(
@@ -490,11 +610,14 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                                 f"УСПЕХ: Сообщение с клавиатурой скрыто у пользователя {user_id}, скачивание началось")
                         except Exception as e:
                             logging.warning(f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
-                    await callback_query.message.answer_audio(
+                    await download_queue.submit(
+                        user_id,
+                        callback_query.message.answer_audio,
                         audio=output_file,
                         caption=caption,
                         parse_mode=None,
-                        supports_streaming=True
+                        supports_streaming=True,
+                        priority=PRIORITY_CACHED
                     )
                     logging.info(f"УСПЕХ: Аудио файл отправлен пользователю {user_id}: {output_file}")
                 else:
@@ -512,12 +635,15 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
                             except Exception as e:
                                 logging.warning(
                                     f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
-                        await callback_query.message.answer_video(
+                        await download_queue.submit(
+                            user_id,
+                            callback_query.message.answer_video,
                             video=output_file,
                             caption=caption,
                             parse_mode=None,
                             supports_streaming=True,
-                            timeout=900
+                            timeout=900,
+                            priority=PRIORITY_CACHED
                         )
                         logging.info(f"УСПЕХ: Видео файл отправлен пользователю {user_id}: {output_file}")
                     except Exception as e:
@@ -554,18 +680,27 @@ async def download_handler(callback_query: types.CallbackQuery, bot:Bot, state:
             else:
                 await bot.send_photo(chat_id=callback_query.from_user.id, photo=ERROR_IMAGE, caption=ERROR_TEXT)
     finally:
+        staging.release(reservation)
+        if is_leader:
+            single_flight.finish(flight_key, id_telegram)
         # Сбрасываем состояние после завершения скачивания
         await state.clear()
 
 
-@router.callback_query(lambda call: call.data.startswith('tt_download:') or call.data.startswith('tt_download_audio:'))
+@router.callback_query(callback_filter('tt_download', 'tt_download_audio'))
 async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, state:FSMContext):
-    format_id = callback_query.data.split(':')[1]
+    kind, token = await format_tokens.resolve(callback_query.data)
+    if token is None:
+        await callback_query.answer("Формат не найден, отправьте ссылку ещё раз.", show_alert=True)
+        return
+    info_id, video_id, format_id, file_size_id, status = token
     user_id = callback_query.from_user.id
-    file_size_id = callback_query.data.split(':')[2]
-    video_id = int(callback_query.data.split(':')[3])
-    info_id = await get_info_id(video_id=video_id, format_id=format_id)
-    status = await get_status_by_id(info_id)
+    # Файл уже есть в Telegram — отправляем сразу, без очереди и состояния скачивания
+    if status and await send_cached(callback_query, bot, info_id, video_id, False):
+        return
+    flight_key = (video_id, format_id)
+    is_leader, shared_file_id, id_telegram = False, None, None
+    reservation = None
 
     if is_under_2gb(file_size_id):
         await callback_query.answer("К сожалению телеграмм не позволяет скачивать файлы больше 2 Гб.", show_alert=True)
@@ -577,6 +712,11 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
         logging.info(f"Пользователь на клавиатуре {user_id} выбрал формат видео {format_id}")
 
         try:
+            # Если этот же файл прямо сейчас качает другой пользователь — ждём его и берём готовый file_id
+            if status == False:
+                is_leader, shared_file_id = await single_flight.join(flight_key)
+                if shared_file_id:
+                    status = True
             if status == False:
                 # Попытка обновить сообщение с клавиатурой
                 if user_id in user_messages:
@@ -593,8 +733,9 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
                         logging.warning(f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
 
                 video = await get_video(video_id)
-                output_file, video_info = await download_tiktok_video(video, format_id)
-                format_get = await get_info_id(video_id=video_id, format_id=format_id)
+                reservation = await staging.reserve(file_size_id)
+                output_file, video_info = await download_queue.submit(user_id, download_tiktok_video, video, format_id)
+                format_get = info_id
                 if output_file is None or video_info is None:
                     logging.error("Ошибка: download_tiktok_video() вернула None!")
                     await callback_query.message.answer("⚠️ Видео недоступно или удалено. Попробуйте ещё раз.")
@@ -610,8 +751,7 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
                     )
                     logging.warning(f"ОШИБКА: {output_file} файл слишком большой ({file_size} byte) для пользователя {user_id}")
                     await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
-                    os.remove(output_file)
-                    logging.info(f"Файл {output_file} УДАЛЕН! ")
+                    staging.discard(output_file, keep=False)
                     return
 
                 # Формируем описание для файла
@@ -642,12 +782,11 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
 
                 file_id = await create_file(video_id=video_id, format_id=format_get, id_telegram=id_telegram)
                 info = await update_info_status(id=format_get)
+                format_tokens.mark_ready(format_get)
                 await increment_tt_count(user_id)
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                    logging.info(f"Файл{output_file} УДАЛЕН!")
+                staging.discard(output_file)
             else:
-                output_file = await get_telegram_id_by_format_id(info_id)
+                output_file = shared_file_id or await get_telegram_id_by_format_id(info_id)
                 video = await get_video(video_id)
                 caption = (
                     f"{emoji.emojize(EMOJIS['title'])} Название: {video.name}\n"
@@ -669,12 +808,15 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
                         except Exception as e:
                             logging.warning(
                                 f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
-                    await callback_query.message.answer_video(
+                    await download_queue.submit(
+                        user_id,
+                        callback_query.message.answer_video,
                         video=output_file,
                         caption=caption,
                         parse_mode=None,
                         supports_streaming=True,
-                        timeout=900
+                        timeout=900,
+                        priority=PRIORITY_CACHED
                     )
                     logging.info(f"УСПЕХ: Видео файл отправлен пользователю {user_id}: {output_file}")
                 except Exception as e:
@@ -711,16 +853,27 @@ async def tt_download_handler(callback_query: types.CallbackQuery, bot: Bot, sta
             else:
                 await bot.send_photo(chat_id=callback_query.from_user.id, photo=ERROR_IMAGE, caption=ERROR_TEXT)
     finally:
+        staging.release(reservation)
+        if is_leader:
+            single_flight.finish(flight_key, id_telegram)
         await state.clear()
 
 
-@router.callback_query(lambda call: call.data.startswith('vk_video:') or call.data.startswith('vk_audio:'))
+@router.callback_query(callback_filter('vk_video', 'vk_audio'))
 async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMContext, bot: Bot):
-    format_id = await get_format_id_by_id(int(callback_query.data.split(':')[1]))
+    kind, token = await format_tokens.resolve(callback_query.data)
+    if token is None:
+        await callback_query.answer("Формат не найден, отправьте ссылку ещё раз.", show_alert=True)
+        return
+    info_id, video_id, format_id, file_size_id, status = token
+    is_audio = kind == 'vk_audio'
     user_id = callback_query.from_user.id
-    file_size_id = callback_query.data.split(':')[2]
-    video_id = int(callback_query.data.split(':')[3])
-    status = await get_status_by_id(int(callback_query.data.split(':')[1]))
+    # Файл уже есть в Telegram — отправляем сразу, без очереди и состояния скачивания
+    if status and await send_cached(callback_query, bot, info_id, video_id, is_audio):
+        return
+    flight_key = (video_id, format_id)
+    is_leader, shared_file_id, id_telegram = False, None, None
+    reservation = None
 
     # Устанавливаем состояние "downloading"
     await state.set_state(DownloadState.downloading)
@@ -747,21 +900,26 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                     logging.warning(f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
 
             # Скачиваем и объединяем файл
+            # Если этот же файл прямо сейчас качает другой пользователь — ждём его и берём готовый file_id
+            if status == False:
+                is_leader, shared_file_id = await single_flight.join(flight_key)
+                if shared_file_id:
+                    status = True
             if status == False:
                 video = await get_video(video_id)
-                output_file, video_info = await download_vk_video_async(video, format_id)
+                priority = PRIORITY_AUDIO if is_audio else PRIORITY_VIDEO
+                reservation = await staging.reserve(file_size_id)
+                output_file, video_info = await download_queue.submit(user_id, download_vk_video_async, video,
+                                                                      format_id, is_audio, priority=priority)
                 if output_file is None or video_info is None:
                     logging.error("Ошибка: download_vk_video() вернула None!")
                     await callback_query.message.answer("⚠️ Видео недоступно или удалено. Попробуйте ещё раз.")
                     return
                 logging.info(f"УСПЕХ: Видео для пользователя {user_id} УСПЕШНО СКАЧАНО {output_file}")
 
-                if callback_query.data.split(':')[0] == 'vk_audio:':
-                    if output_file.endswith('.webm'):
-                        output_path = await convert_webm_to_m4a(output_file)
-                        output_file = output_path
-                        logging.info(
-                            f"УСПЕХ: Аудио файл полученный от пользователя {user_id}: {output_file} переконвертировался в M4A")
+                if is_audio:
+                    output_file = await remux_audio(output_file)
+                    logging.info(f"УСПЕХ: Аудио файл для пользователя {user_id}: {output_file}")
 
 
                 # Проверка размера файла
@@ -771,8 +929,7 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                                             не позволяет отправлять файлы больше 2 ГБ.", disable_web_page_preview=True)
                     await bot.send_message(chat_id=user_id, text=f'\n\n Жду следующую ссылку.... \n\n')
                     logging.warning(f"ОШИБКА: {output_file} файл слишком большой ({file_size} byte) для пользователя {user_id}")
-                    os.remove(output_file)
-                    logging.info(f"Файл {output_file} УДАЛЕН! ")
+                    staging.discard(output_file, keep=False)
                     return
                 info = await get_info_by_video_and_format(video_id=video_id, format_id=format_id)
 
@@ -796,7 +953,7 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                     f"{emoji.emojize(EMOJIS['size'])} Размер файла: {file_size_id}\n"
                 )
                 # Отправляем аудио
-                if callback_query.data.split(':')[0] == 'vk_audio:' or output_file.endswith('.m4a'):
+                if is_audio or output_file.endswith(('.m4a', '.ogg')):
                     if user_id in user_messages:
                         try:
                             await bot.edit_message_caption(
@@ -846,15 +1003,18 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                     except Exception as e:
                         logging.error(f"ОШИБКА: файл не удалось ОТПРАВИТЬ {user_id}: {e}")
 
-                file_id = await create_file(video_id=video_id, format_id=int(callback_query.data.split(':')[1]), id_telegram=id_telegram)
+                if not id_telegram:
+                    # Отправка не удалась: формат не помечаем загруженным, иначе в базе останется пустой file_id
+                    staging.discard(output_file, keep=False)
+                    raise RuntimeError(f"файл {output_file} не отправлен в Telegram")
+                file_id = await create_file(video_id=video_id, format_id=info_id, id_telegram=id_telegram)
                 info = await update_info_status(id=info.id)
+                format_tokens.mark_ready(info_id)
                 await increment_vk_count(user_id)
 
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                    logging.info(f"Файл {output_file} УДАЛЕН!")
+                staging.discard(output_file)
             else:
-                output_file = await get_telegram_id_by_format_id(int(callback_query.data.split(':')[1]))
+                output_file = shared_file_id or await get_telegram_id_by_format_id(info_id)
                 video = await get_video(video_id)
                 caption = (
                     f"{emoji.emojize(EMOJIS['title'])} Название: {video.name}\n"
@@ -862,7 +1022,7 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                     f"{emoji.emojize(EMOJIS['durations'])} Длительность: {video.time // 60} мин {video.time % 60} сек\n"
                     f"{emoji.emojize(EMOJIS['date'])} Дата загрузки: {video.date}\n\n"
                     )
-                if callback_query.data.startswith('vk_audio'):
+                if is_audio:
                     if user_id in user_messages:
                         try:
                             await bot.edit_message_caption(
@@ -875,11 +1035,14 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                                 f"УСПЕХ: Сообщение с клавиатурой скрыто у пользователя {user_id}, скачивание началось")
                         except Exception as e:
                             logging.warning(f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
-                    await callback_query.message.answer_audio(
+                    await download_queue.submit(
+                        user_id,
+                        callback_query.message.answer_audio,
                         audio=output_file,
                         caption=caption,
                         parse_mode=None,
-                        supports_streaming=True
+                        supports_streaming=True,
+                        priority=PRIORITY_CACHED
                     )
                     logging.info(f"УСПЕХ: Аудио файл отправлен пользователю {user_id}: {output_file}")
                 else:
@@ -897,12 +1060,15 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
                             except Exception as e:
                                 logging.warning(
                                     f"ОШИБКА: Произошла ошибка при попытке сокрытия клавиатуры у {user_id}: {e}")
-                        await callback_query.message.answer_video(
+                        await download_queue.submit(
+                            user_id,
+                            callback_query.message.answer_video,
                             video=output_file,
                             caption=caption,
                             parse_mode=None,
                             supports_streaming=True,
-                            timeout=900
+                            timeout=900,
+                            priority=PRIORITY_CACHED
                         )
                         logging.info(f"УСПЕХ: Видео файл отправлен пользователю {user_id}: {output_file}")
                     except Exception as e:
@@ -937,6 +1103,9 @@ async def vk_download_handler(callback_query: types.CallbackQuery, state: FSMCon
             else:
                 await bot.send_photo(chat_id=callback_query.from_user.id, photo=ERROR_IMAGE, caption=ERROR_TEXT)
     finally:
+        staging.release(reservation)
+        if is_leader:
+            single_flight.finish(flight_key, id_telegram)
         await state.clear()
 
 
@@ -947,16 +1116,17 @@ async def inline_query_handler(query: types.InlineQuery):
     # Проверяем, запрошен ли список всех видео с канала (по ID)
     if query_text.startswith("channel_id_"):
         channel_id = query_text.replace("channel_id_", "").strip()
-        videos_data = await get_channel_videos(channel_id)
+        # offset — токен следующей страницы плейлиста загрузок, за раз запрашиваем одну страницу
+        videos_data = await get_channel_videos(channel_id, offset=query.offset or "", limit=20)
 
-        if not videos_data or "videos" not in videos_data:
+        if not videos_data or not videos_data["videos"]:
             await query.answer([], cache_time=5, switch_pm_text="Видео не найдены", switch_pm_parameter="start")
             return
 
         videos = videos_data["videos"]
         results = []
 
-        for video in videos[:20]:  # Ограничиваем выдачу 20 видео
+        for video in videos:
             results.append(
                 InlineQueryResultVideo(
                     id=video["id"],
@@ -971,17 +1141,32 @@ async def inline_query_handler(query: types.InlineQuery):
                 )
             )
 
-        await query.answer(results, cache_time=5)
+        await query.answer(results, cache_time=5, next_offset=videos_data["next_offset"])
         return
 
     # Обычный поиск по YouTube (каналы + видео)
     offset = query.offset or ""
-    results, next_offset = await search_youtube(query_text, offset)
+    user_id = query.from_user.id
 
-    if results:
-        await query.answer(results, cache_time=5, next_offset=next_offset)
-    else:
-        await query.answer([], cache_time=5, switch_pm_text="Видео не найдено", switch_pm_parameter="start")
+    # Пока пользователь печатает, ищем только последний вариант запроса; подгрузку страниц не задерживаем
+    token = None
+    if not offset:
+        token = await inline_debouncer.wait(user_id)
+        if token is None:
+            return
+
+    try:
+        results, next_offset = await search_youtube(query_text, offset)
+        if token is not None and not inline_debouncer.is_latest(user_id, token):
+            return
+
+        if results:
+            await query.answer(results, cache_time=5, next_offset=next_offset)
+        else:
+            await query.answer([], cache_time=5, switch_pm_text="Видео не найдено", switch_pm_parameter="start")
+    finally:
+        if token is not None:
+            inline_debouncer.done(user_id, token)
 
 
 # @router.inline_query()
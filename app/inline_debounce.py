@@ -0,0 +1,51 @@
+from config import INLINE_DEBOUNCE
+
+import asyncio
+
+
+class InlineDebouncer:
+    """
+    Подавляет инлайн-запросы, которые пользователь успел «перепечатать».
+
+    Telegram присылает запрос почти на каждый введённый символ. Каждый новый запрос пользователя
+    вытесняет предыдущий: до поиска доходит только тот, после которого пользователь не печатал
+    дольше delay секунд, а ответ устаревшего запроса не отправляется.
+    """
+
+    def __init__(self, delay: float = INLINE_DEBOUNCE):
+        self.delay = delay
+        self._latest = {}
+        self.superseded = 0
+
+    async def wait(self, user_id: int):
+        """
+        Регистрирует новый запрос пользователя и ждёт паузу в наборе.
+
+        Args:
+            user_id (int): ID пользователя Telegram.
+
+        Returns:
+            object | None: Токен запроса, если он остался последним, иначе None.
+        """
+        token = object()
+        self._latest[user_id] = token
+        await asyncio.sleep(self.delay)
+        if self._latest.get(user_id) is not token:
+            self.superseded += 1
+            return None
+        return token
+
+    def is_latest(self, user_id: int, token) -> bool:
+        """Проверяет, что после запроса с этим токеном пользователь не прислал новый."""
+        if self._latest.get(user_id) is token:
+            return True
+        self.superseded += 1
+        return False
+
+    def done(self, user_id: int, token):
+        """Убирает запрос из учёта, если он всё ещё последний."""
+        if self._latest.get(user_id) is token:
+            del self._latest[user_id]
+
+
+inline_debouncer = InlineDebouncer()
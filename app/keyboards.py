@@ -2,9 +2,10 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from rest import EMOJIS
 import emoji
-from data.infos_func import get_status_by_id, get_info_id
 from aiogram import Bot
 from aiogram.types import BotCommand
+from collections import OrderedDict
+from app.callback_tokens import encode_callback
 
 
 find_yt_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -41,22 +42,55 @@ def all_videos_channel(id_channel):
     ])
 
 
-async def main_kb(filtered_formats, audio_id, audio_size, video) -> InlineKeyboardMarkup:
-    button_list = []
-    info_id = await get_info_id(video_id=video, format_id=audio_id)
-    status = await get_status_by_id(info_id)
-    fire_emoji = emoji.emojize(EMOJIS['fire']) if status else ""
+# Готовые клавиатуры форматов: ключ — (тип клавиатуры, ID видео, статусы форматов)
+KEYBOARD_CACHE_SIZE = 1000
+_keyboards = OrderedDict()
+
+
+def _memo(key, build) -> InlineKeyboardMarkup:
+    """
+    Возвращает клавиатуру из кэша или строит её через build().
+
+    Набор форматов у видео не меняется, меняются только статусы (файл уже загружен или нет),
+    поэтому статусы входят в ключ и после первой загрузки формата клавиатура строится заново.
+    """
+    keyboard = _keyboards.get(key)
+    if keyboard is None:
+        keyboard = build()
+        _keyboards[key] = keyboard
+        while len(_keyboards) > KEYBOARD_CACHE_SIZE:
+            _keyboards.popitem(last=False)
+    else:
+        _keyboards.move_to_end(key)
+    return keyboard
+
+
+def _statuses(formats) -> tuple:
+    return tuple(bool(f.get('status')) for f in formats)
+
+
+def main_kb(filtered_formats, audio_id, audio_size, video, audio_status=False,
+            audio_info_id=None) -> InlineKeyboardMarkup:
     audio_full_size = f'{round(audio_size / (1024 ** 2), 2)} MB'
+    key = ("yt", video, bool(audio_status), _statuses(filtered_formats))
+    return _memo(key, lambda: _build_main_kb(filtered_formats, audio_id, audio_full_size, video, audio_status,
+                                             audio_info_id))
+
+
+def _build_main_kb(filtered_formats, audio_id, audio_full_size, video, audio_status,
+                   audio_info_id) -> InlineKeyboardMarkup:
+    button_list = []
+    fire_emoji = emoji.emojize(EMOJIS['fire']) if audio_status else ""
     button_list.append([InlineKeyboardButton(
         text=(f" Cкачать {emoji.emojize(EMOJIS['sound'])} аудио {emoji.emojize(EMOJIS['size'])} {audio_full_size}"
               f'{fire_emoji}'),
-        callback_data=f"yt_audio:{audio_id}:{audio_full_size}:{video}")])
+        callback_data=encode_callback("yt_audio", audio_info_id))])
 
     for f in filtered_formats:
         format_id = f['format_id']
         if format_id:
             fire_emoji = emoji.emojize(EMOJIS['fire']) if f.get('status') else ""
-            callback_data = f"yt_video:{f['format_id']}:{f['filesize']}:{video}"
+            callback_data = encode_callback("yt_video", f['info_id'])
             button_list.append([InlineKeyboardButton(
                 text=(
                     f" Cкачать {emoji.emojize(EMOJIS['resolutions'])} {f['resolution']} "
@@ -70,46 +104,55 @@ async def main_kb(filtered_formats, audio_id, audio_size, video) -> InlineKeyboa
     return keyboard
 
 
-async def make_keyboard_vk(formats, video_id):
+def make_keyboard_vk(formats, video_id):
     """
     Создаёт клавиатуру с кнопками для скачивания аудио и видео из VK.
 
     Args:
-        formats (list[dict]): Список форматов (каждый — словарь с format_id, resolution, filesize).
+        formats (list[dict]): Список форматов (каждый — словарь с info_id, format_id, resolution, filesize).
         video_id (int): ID видео (используется в callback).
 
     Returns:
         InlineKeyboardMarkup: Клавиатура с кнопками загрузки.
     """
+    return _memo(("vk", video_id, _statuses(formats)), lambda: _build_keyboard_vk(formats, video_id))
+
+
+def _build_keyboard_vk(formats, video_id) -> InlineKeyboardMarkup:
     button_list = []
 
     for f in formats:
-        print(f)
         # Пропускаем, если размер не указан или нулевой
         if f['filesize'] in (0, '0', '0.0 MB'):
             continue
 
         fire_emoji = emoji.emojize(EMOJIS['fire']) if f.get('status') else ""
-        res_icon = emoji.emojize(EMOJIS['sound'] if f['resolution'] == "Аудио" else EMOJIS['resolutions'])
+        # Строки из базы несут type, свежие форматы из get_formats_vk_video — resolution "audio"
+        is_audio = f.get('type', 'Audio' if f['resolution'] == 'audio' else 'Video') == 'Audio'
+        res_icon = emoji.emojize(EMOJIS['sound'] if is_audio else EMOJIS['resolutions'])
 
         button_text = (
             f"Скачать {res_icon} {f['resolution']} "
             f"{emoji.emojize(EMOJIS['size'])} {f['filesize']} {fire_emoji}"
         )
 
-        callback_type = "vk_audio" if f['resolution'] == "Аудио" else "vk_video"
+        callback_type = "vk_audio" if is_audio else "vk_video"
 
         button_list.append([
             InlineKeyboardButton(
                 text=button_text.strip(),
-                callback_data=f"{callback_type}:{await get_info_id(video_id=video_id, format_id=f['format_id'])}:{f['filesize']}:{video_id}"
+                callback_data=encode_callback(callback_type, f['info_id'])
             )
         ])
 
     return InlineKeyboardMarkup(inline_keyboard=button_list)
 
 
-async def main_kb_tt(formats, video):
+def main_kb_tt(formats, video) -> InlineKeyboardMarkup:
+    return _memo(("tt", video, _statuses(formats)), lambda: _build_main_kb_tt(formats, video))
+
+
+def _build_main_kb_tt(formats, video) -> InlineKeyboardMarkup:
     button_list = []
     for f in formats:
         if f['filesize'] == 0:
@@ -119,7 +162,7 @@ async def main_kb_tt(formats, video):
             text=(f" Cкачать {emoji.emojize(EMOJIS['resolutions'])} {f['resolution']} "
                   f"{emoji.emojize(EMOJIS['size'])} {f['filesize']}"
                   f"{fire_emoji}"),
-                callback_data=f"tt_download:{f['format_id']}:{f['filesize']}:{video}")])
+                callback_data=encode_callback("tt_download", f['info_id']))])
 
     # Создаем клавиатуру с кнопками
     keyboard = InlineKeyboardMarkup(inline_keyboard=button_list)
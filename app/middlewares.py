@@ -0,0 +1,38 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from database import AsyncSessionLocal
+from typing import Any, Awaitable, Callable, Dict
+
+import logging
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Одна сессия базы данных и одна транзакция на апдейт.
+
+    Хэндлер получает сессию аргументом `session` и передаёт её в функции из data/*_func.py,
+    поэтому запись пользователя, канала, видео и форматов идёт в одной транзакции. Хэндлеры ссылок
+    коммитят её сами перед обращениями к Telegram, чтобы медленный ответ API не держал соединение
+    и блокировки строк; остаток фиксируется коммитом после завершения хэндлера. Если хэндлер сам
+    перехватил ошибку, он откатывает сессию до возврата, и коммиту middleware фиксировать нечего.
+
+    Подключается только к сообщениям (обработка ссылок). Хэндлеры кнопок скачивания держат апдейт
+    на всё время загрузки, поэтому общую транзакцию им не дают: каждая их запись — отдельная короткая сессия.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with AsyncSessionLocal() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+                await session.commit()
+                return result
+            except Exception as e:
+                logging.error(f"ОШИБКА: транзакция апдейта откатена: {e}")
+                await session.rollback()
+                raise
@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+import unicodedata
+import asyncio
+import time
+import re
+
+
+def normalize_query(query: str) -> str:
+    """
+    Приводит поисковый запрос к единому виду: регистр, юникод-форма и пробелы.
+
+    "  Lo-Fi   Beats " и "lo-fi beats" дают один и тот же ключ кэша.
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class SearchCache:
+    """
+    LRU-кэш результатов инлайн-поиска с временем жизни и склейкой одинаковых запросов.
+
+    Ключ — (нормализованный запрос, токен страницы). Пока запрос по ключу выполняется, остальные
+    такие же запросы ждут его результат, а не идут в API. Просроченные записи не удаляются сразу:
+    их можно отдать как устаревшие, когда квота API на исходе.
+    """
+
+    def __init__(self, max_size: int = SEARCH_CACHE_SIZE, ttl: int = SEARCH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, allow_stale: bool = False):
+        item = self._items.get(key)
+        if item is None or (item[0] < time.monotonic() and not allow_stale):
+            return None
+        self._items.move_to_end(key)
+        return item[1]
+
+    def put(self, key, value):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def load(self, key, loader):
+        """
+        Возвращает значение из кэша или выполняет loader(), склеивая одновременные запросы.
+
+        Запрос к API выполняется отдельной задачей: если ожидающего отменят (пользователь ввёл
+        следующий символ), ответ всё равно попадёт в кэш и пригодится следующему такому же запросу.
+
+        Args:
+            key: Ключ кэша.
+            loader: Функция без аргументов, возвращающая корутину с результатом.
+
+        Returns:
+            Результат loader() (из кэша, из уже выполняющегося запроса или новый).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(loader())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+
+search_cache = SearchCache()
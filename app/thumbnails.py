@@ -0,0 +1,134 @@
+from aiogram.types import BufferedInputFile
+from collections import OrderedDict
+from config import THUMB_CACHE_BYTES
+from extractor import extractor
+from http_client import get_session
+from PIL import Image
+from io import BytesIO
+
+import hashlib
+import logging
+
+
+# Telegram file_id уже отправленных миниатюр — повторно их не скачиваем и не перекодируем
+MAX_FILE_IDS = 10000
+
+
+class ThumbnailCache:
+    """
+    Кэш миниатюр по хэшу URL.
+
+    Хранит готовые к отправке байты (JPEG после конвертации WebP) с вытеснением по суммарному размеру
+    и Telegram file_id фото, которые уже были отправлены.
+    """
+
+    def __init__(self, max_bytes: int = THUMB_CACHE_BYTES, max_file_ids: int = MAX_FILE_IDS):
+        self.max_bytes = max_bytes
+        self.max_file_ids = max_file_ids
+        self._images = OrderedDict()
+        self._file_ids = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()
+
+    def get_file_id(self, url: str):
+        key = self.key(url)
+        file_id = self._file_ids.get(key)
+        if file_id:
+            self._file_ids.move_to_end(key)
+        return file_id
+
+    def put_file_id(self, url: str, file_id: str):
+        key = self.key(url)
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+        # После отправки Telegram хранит картинку сам — байты больше не нужны
+        image = self._images.pop(key, None)
+        if image:
+            self._size -= len(image[0])
+
+    def get_image(self, url: str):
+        key = self.key(url)
+        image = self._images.get(key)
+        if image:
+            self._images.move_to_end(key)
+        return image
+
+    def put_image(self, url: str, data: bytes, filename: str):
+        if len(data) > self.max_bytes:
+            return
+        key = self.key(url)
+        old = self._images.pop(key, None)
+        if old:
+            self._size -= len(old[0])
+        self._images[key] = (data, filename)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, (old_data, _) = self._images.popitem(last=False)
+            self._size -= len(old_data)
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+def _convert_image(data: bytes, content_type: str, url: str) -> tuple:
+    # Перекодирование WebP в JPEG (Telegram не принимает WebP как фото), выполняется в пуле потоков
+    if "webp" in content_type or url.endswith(".webp"):
+        image = Image.open(BytesIO(data)).convert("RGB")
+        output = BytesIO()
+        image.save(output, format="JPEG")
+        return output.getvalue(), "converted.jpg"
+    return data, "original.jpg"
+
+
+async def prepare_image_for_telegram(url: str, stored_file_id: str = None):
+    """
+    Готовит миниатюру к отправке в Telegram.
+
+    Память процесса — только передний кэш: file_id, сохранённый в Video.thumbnail, переживает перезапуск,
+    и по нему картинка не скачивается и не перекодируется заново.
+
+    Args:
+        url (str): Ссылка на миниатюру.
+        stored_file_id (str): file_id из Video.thumbnail этого видео, если он есть в базе.
+
+    Returns:
+        str | BufferedInputFile: file_id уже отправленной картинки или файл с байтами изображения.
+    """
+    if stored_file_id:
+        thumbnail_cache.put_file_id(url, stored_file_id)
+        return stored_file_id
+
+    file_id = thumbnail_cache.get_file_id(url)
+    if file_id:
+        logging.debug(f"Миниатюра {url} уже есть в Telegram, отправляю по file_id")
+        return file_id
+
+    image = thumbnail_cache.get_image(url)
+    if image is None:
+        session = await get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            data = await response.read()
+        image = await extractor.run(_convert_image, data, content_type, url)
+        thumbnail_cache.put_image(url, *image)
+
+    data, filename = image
+    return BufferedInputFile(data, filename=filename)
+
+
+def remember_thumbnail(url: str, file_id: str):
+    """
+    Запоминает Telegram file_id миниатюры, чтобы в следующий раз отправлять её без загрузки.
+
+    Args:
+        url (str): Ссылка на миниатюру.
+        file_id (str): file_id фото из ответа Telegram.
+    """
+    if url and file_id:
+        thumbnail_cache.put_file_id(url, file_id)
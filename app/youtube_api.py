@@ -0,0 +1,122 @@
+from config import YOUTUBE_API_KEY, YOUTUBE_DAILY_QUOTA
+from http_client import get_json
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from datetime import datetime, timezone, timedelta
+
+import logging
+
+
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+
+# Частичные ответы (fields=): запрашиваем только те поля, которые бот реально использует
+SEARCH_CHANNEL_FIELDS = "items(id/channelId,snippet(title,thumbnails/high/url))"
+SEARCH_VIDEO_FIELDS = "nextPageToken,items(id/videoId,snippet(title,description,thumbnails/high/url))"
+CHANNEL_FIELDS = ("items(id,snippet(title,thumbnails/high/url),contentDetails/relatedPlaylists/uploads,"
+                  "statistics(subscriberCount,videoCount))")
+PLAYLIST_ITEMS_FIELDS = "nextPageToken,items(snippet(title,channelTitle,resourceId/videoId,thumbnails/high/url))"
+
+# Стоимость запросов в единицах квоты; всё, что не перечислено, стоит 1
+QUOTA_COSTS = {"search": 100}
+
+# Квота YouTube обнуляется в полночь по тихоокеанскому времени
+try:
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except ZoneInfoNotFoundError:
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+class QuotaCounter:
+    """Считает израсходованные за сутки единицы квоты YouTube Data API."""
+
+    def __init__(self, daily_limit: int = YOUTUBE_DAILY_QUOTA):
+        self.daily_limit = daily_limit
+        self.used = 0
+        self._day = self._today()
+
+    @staticmethod
+    def _today():
+        return datetime.now(QUOTA_TIMEZONE).date()
+
+    def _roll(self):
+        today = self._today()
+        if today != self._day:
+            logging.info(f"Новые сутки квоты YouTube API, за прошлые израсходовано {self.used}")
+            self._day = today
+            self.used = 0
+
+    def spend(self, units: int):
+        self._roll()
+        self.used += units
+
+    def remaining(self) -> int:
+        self._roll()
+        return max(self.daily_limit - self.used, 0)
+
+    def can_spend(self, units: int, reserve: float = 0.0) -> bool:
+        """Проверяет, можно ли потратить units, оставив нетронутой долю reserve от суточной квоты."""
+        return self.remaining() - units >= self.daily_limit * reserve
+
+
+class YouTubeAPI:
+    """
+    Асинхронный клиент YouTube Data API v3 поверх общей HTTP-сессии.
+
+    Каждый метод — один запрос к API, поэтому независимые запросы можно выполнять параллельно
+    через asyncio.gather. Параметр fields ограничивает ответ нужными полями.
+    """
+
+    def __init__(self, api_key: str = YOUTUBE_API_KEY, base_url: str = YOUTUBE_API_URL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.quota = QuotaCounter()
+
+    async def request(self, resource: str, **params) -> dict:
+        """
+        Выполняет запрос к ресурсу API.
+
+        Args:
+            resource (str): Ресурс API, например "search" или "channels".
+            **params: Параметры запроса; значения None не передаются.
+
+        Returns:
+            dict: Ответ API.
+        """
+        # Google списывает квоту и за неудачные запросы, поэтому считаем до отправки
+        self.quota.spend(QUOTA_COSTS.get(resource, 1))
+        return await get_json(f"{self.base_url}/{resource}", {**params, "key": self.api_key})
+
+    async def search(self, query: str, type: str, max_results: int = 25, page_token: str = None,
+                     fields: str = None) -> dict:
+        return await self.request(
+            "search",
+            q=query,
+            part="id,snippet",
+            type=type,
+            maxResults=max_results,
+            pageToken=page_token or None,
+            fields=fields,
+        )
+
+    async def channels(self, channel_id: str = None, for_username: str = None,
+                       part: str = "snippet,contentDetails,statistics", fields: str = None) -> dict:
+        return await self.request(
+            "channels",
+            part=part,
+            id=channel_id,
+            forUsername=for_username,
+            fields=fields,
+        )
+
+    async def playlist_items(self, playlist_id: str, max_results: int = 50, page_token: str = None,
+                             fields: str = PLAYLIST_ITEMS_FIELDS) -> dict:
+        return await self.request(
+            "playlistItems",
+            part="snippet",
+            playlistId=playlist_id,
+            maxResults=max_results,
+            pageToken=page_token or None,
+            fields=fields,
+        )
+
+
+youtube = YouTubeAPI()
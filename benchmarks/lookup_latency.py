@@ -0,0 +1,92 @@
+"""
+Замер задержки горячих запросов к базе до и после индексов из data/migrations.py.
+
+Создаёт временную базу SQLite с каталогом заданного размера (по умолчанию 1 000 000 видео,
+по 4 формата на видео и файл на каждое десятое видео) и выполняет те же запросы, что
+is_video_in_db, get_info_id и get_telegram_id_by_format_id.
+
+Запуск из корня проекта:
+    python -m benchmarks.lookup_latency --videos 1000000 --queries 200
+"""
+from data.migrations import INDEXES
+
+import argparse
+import tempfile
+import sqlite3
+import random
+import time
+import os
+
+
+SCHEMA = [
+    "CREATE TABLE videos (id INTEGER PRIMARY KEY, youtube_id TEXT UNIQUE NOT NULL, url TEXT NOT NULL)",
+    "CREATE TABLE infos (id INTEGER PRIMARY KEY, video_id INTEGER NOT NULL, format_id TEXT NOT NULL)",
+    "CREATE TABLE files (id INTEGER PRIMARY KEY, video_id INTEGER NOT NULL, format_id INTEGER NOT NULL, "
+    "id_telegram TEXT)",
+]
+
+QUERIES = {
+    "videos.url": ("SELECT id FROM videos WHERE url = ?",
+                   lambda n: (f"https://www.youtube.com/watch?v={random.randrange(n):011d}",)),
+    "infos.video_id+format_id": ("SELECT id FROM infos WHERE video_id = ? AND format_id = ?",
+                                 lambda n: (random.randrange(1, n + 1), "137")),
+    "files.format_id": ("SELECT id_telegram FROM files WHERE format_id = ?",
+                        lambda n: (random.randrange(1, 4 * n + 1),)),
+}
+
+
+def fill(conn: sqlite3.Connection, videos: int):
+    conn.executemany("INSERT INTO videos (id, youtube_id, url) VALUES (?, ?, ?)", (
+        (i + 1, f"{i:011d}", f"https://www.youtube.com/watch?v={i:011d}") for i in range(videos)
+    ))
+    conn.executemany("INSERT INTO infos (video_id, format_id) VALUES (?, ?)", (
+        (i + 1, f) for i in range(videos) for f in ("140", "18", "136", "137")
+    ))
+    conn.executemany("INSERT INTO files (video_id, format_id, id_telegram) VALUES (?, ?, ?)", (
+        (i + 1, 4 * i + 4, f"file_{i}") for i in range(0, videos, 10)
+    ))
+    conn.commit()
+
+
+def measure(conn: sqlite3.Connection, videos: int, queries: int) -> dict:
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        timings = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            conn.execute(sql, params(videos)).fetchall()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        results[name] = (timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        for statement in SCHEMA:
+            conn.execute(statement)
+        started = time.perf_counter()
+        fill(conn, args.videos)
+        print(f"Каталог из {args.videos} видео создан за {time.perf_counter() - started:.1f} с")
+
+        before = measure(conn, args.videos, args.queries)
+        for statement in INDEXES:
+            conn.execute(statement)
+        conn.commit()
+        after = measure(conn, args.videos, args.queries)
+        conn.close()
+
+    print(f"{'запрос':<28}{'без индексов p50/p99, мс':>28}{'с индексами p50/p99, мс':>28}")
+    for name in QUERIES:
+        (b50, b99), (a50, a99) = before[name], after[name]
+        print(f"{name:<28}{b50 * 1000:>17.3f} / {b99 * 1000:<8.3f}{a50 * 1000:>17.3f} / {a99 * 1000:<8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from aiogram.client.telegram import TelegramAPIServer
 from aiogram.client.session.aiohttp import AiohttpSession
 import logging
+import shutil
 import os
 from dotenv import load_dotenv
 
@@ -19,6 +20,76 @@ logging.basicConfig(
                 format="%(asctime)s - %(levelname)s - %(message)s"
             )
 
-ffmpeg_path = os.path.abspath("ffmpeg/bin/ffmpeg.exe")
+# Один путь к ffmpeg для всего бота: FFMPEG_PATH из окружения, иначе ffmpeg из PATH, иначе сборка в папке проекта
+ffmpeg_path = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg") or os.path.abspath("ffmpeg/bin/ffmpeg.exe")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
+
+# Очередь загрузок: сколько закачек идёт одновременно на весь бот и на одного пользователя
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 3))
+DOWNLOAD_PER_USER = int(os.getenv("DOWNLOAD_PER_USER", 1))
+# Отдельные воркеры для мгновенной пересылки уже загруженных файлов (file_id из базы)
+FAST_SEND_WORKERS = int(os.getenv("FAST_SEND_WORKERS", 4))
+
+# Кэш метаданных yt-dlp: размер, время жизни записи и время жизни "отрицательных" записей (видео недоступно)
+META_CACHE_SIZE = int(os.getenv("META_CACHE_SIZE", 500))
+META_CACHE_TTL = int(os.getenv("META_CACHE_TTL", 1800))
+META_NEGATIVE_TTL = int(os.getenv("META_NEGATIVE_TTL", 300))
+# Передавать закэшированный info в загрузку, чтобы не вызывать extract_info второй раз
+META_REUSE_FOR_DOWNLOAD = os.getenv("META_REUSE_FOR_DOWNLOAD", "1") == "1"
+
+# Пул для извлечения метаданных yt-dlp: "thread" или "process", число воркеров и таймаут одного запроса (сек)
+EXTRACT_POOL = os.getenv("EXTRACT_POOL", "thread")
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", 4))
+EXTRACT_TIMEOUT = int(os.getenv("EXTRACT_TIMEOUT", 60))
+
+# Кэш миниатюр: сколько байт сконвертированных картинок держим в памяти
+THUMB_CACHE_BYTES = int(os.getenv("THUMB_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Общий пул исходящих HTTP-соединений: всего, на один хост, время жизни DNS-кэша и keep-alive (сек)
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 100))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 20))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE = int(os.getenv("HTTP_KEEPALIVE", 60))
+
+# Кэш инлайн-поиска и суточная квота YouTube Data API (единицы квоты, поиск стоит 100)
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 2000))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 3600))
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", 10000))
+# Доля квоты, которую поиск не трогает, чтобы остались единицы на ссылки на каналы
+SEARCH_QUOTA_RESERVE = float(os.getenv("SEARCH_QUOTA_RESERVE", 0.1))
+
+# Пауза (сек) после последнего символа инлайн-запроса, прежде чем идти в поиск
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", 0.6))
+
+# Раз в сколько секунд сбрасывать накопленные счётчики скачиваний в базу; 0 — писать сразу
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", 0))
+
+# Прогрев индекса отправленных файлов при старте и размер одной пачки при чтении из базы
+WARM_FILE_INDEX = os.getenv("WARM_FILE_INDEX", "0") == "1"
+WARM_BATCH_SIZE = int(os.getenv("WARM_BATCH_SIZE", 5000))
+# Сколько file_id держать в индексе в памяти: запись — около 300 байт, 200 000 записей — порядка 60 МБ;
+# вытесненные файлы берутся из базы
+FILE_INDEX_SIZE = int(os.getenv("FILE_INDEX_SIZE", 200000))
+
+# Потоковая отправка видео YouTube: ffmpeg склеивает фрагментированный MP4 прямо в запрос к Bot API, без файла на диске
+# Отправка идёт в сервер Bot API из session выше; с публичным api.telegram.org (лимит 50 МБ) не включается
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "0") == "1"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))
+
+# Место под временные файлы загрузок: бюджет и минимум свободного места на диске (байты),
+# запас на промежуточные файлы yt-dlp, сколько ждать места (сек), возраст брошенных файлов (сек),
+# сколько держать отправленный файл для повторной отправки (сек, 0 — удалять сразу) и период уборки (сек)
+STAGING_BUDGET = int(os.getenv("STAGING_BUDGET", 20 * 1024 ** 3))
+STAGING_MIN_FREE = int(os.getenv("STAGING_MIN_FREE", 2 * 1024 ** 3))
+STAGING_RESERVE_FACTOR = float(os.getenv("STAGING_RESERVE_FACTOR", 2.0))
+STAGING_WAIT = float(os.getenv("STAGING_WAIT", 600))
+STAGING_ORPHAN_AGE = float(os.getenv("STAGING_ORPHAN_AGE", 6 * 3600))
+STAGING_KEEP_SENT = float(os.getenv("STAGING_KEEP_SENT", 0))
+STAGING_SWEEP_INTERVAL = float(os.getenv("STAGING_SWEEP_INTERVAL", 600))
+
+# Процессы ffmpeg: сколько одновременно (по умолчанию по числу ядер), приоритет CPU (nice)
+# и диска (ionice -c 3, только когда диск простаивает)
+FFMPEG_CONCURRENCY = int(os.getenv("FFMPEG_CONCURRENCY", os.cpu_count() or 2))
+FFMPEG_NICE = int(os.getenv("FFMPEG_NICE", 10))
+FFMPEG_IONICE = os.getenv("FFMPEG_IONICE", "1") == "1"
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from config import FILE_INDEX_SIZE
+
+
+class FileIndex:
+    """
+    Индекс загруженных в Telegram файлов в памяти.
+
+    ID записи Info -> file_id. Ссылки сводятся к каноническому видео ещё в create_video, поэтому у одного
+    видео с платформы одна запись Video, и ID записи Info однозначно задаёт видео и формат.
+    Заполняется при старте из таблицы files (files_func.warm_file_index), а дальше — по мере загрузок в create_file.
+    Размер ограничен max_size записей с вытеснением давно не использованных: промах индекса — не ошибка,
+    файл тогда ищется в базе.
+    """
+
+    def __init__(self, max_size: int = FILE_INDEX_SIZE):
+        self.max_size = max_size
+        self._by_info = OrderedDict()
+        self.loaded = False
+
+    def put(self, info_id: int, file_id: str):
+        self._by_info[info_id] = file_id
+        self._by_info.move_to_end(info_id)
+        while len(self._by_info) > self.max_size:
+            self._by_info.popitem(last=False)
+
+    def get(self, info_id: int):
+        file_id = self._by_info.get(info_id)
+        if file_id is not None:
+            self._by_info.move_to_end(info_id)
+        return file_id
+
+    def __len__(self):
+        return len(self._by_info)
+
+
+file_index = FileIndex()
@@ -1,53 +1,106 @@
 from data.models import File
-from database import AsyncSessionLocal
+from data.file_index import file_index
+from database import use_session
+from config import WARM_BATCH_SIZE
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from sqlalchemy import event
 
+import asyncio
+import logging
+import time
 
-async def create_file(video_id: int, format_id: int, playlist_id: int = None, id_telegram: str = None):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            # Проверяем, есть ли уже файл с таким video_id и format_id
-            result = await session.execute(
-                select(File).filter(File.video_id == video_id, File.format_id == format_id)
-            )
-            existing_file = result.scalars().first()
-
-            if existing_file:
-                return existing_file.id_telegram  # Если файл есть, возвращаем его id_telegram
-
-            # Если файла нет, создаём новую запись
-            new_file = File(
-                video_id=video_id,
-                format_id=format_id,
-                playlist_id=playlist_id,
-                id_telegram=id_telegram
-            )
-            session.add(new_file)
-            await session.flush()  # Фиксируем ID нового объекта перед коммитом
-
-        await session.commit()
-        return new_file.id_telegram  # Возвращаем id_telegram нового файла
-async def add_file_to_playlist(file_id: int, playlist_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            file = await session.get(File, file_id)
-            if file:
-                file.playlist_id = playlist_id
-        await session.commit()
-async def delete_file(file_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            file = await session.get(File, file_id)
-            if file:
-                await session.delete(file)
-        await session.commit()
-async def get_file(file_id: int):
-    async with AsyncSessionLocal() as session:
+
+@event.listens_for(Session, "after_commit")
+def _index_committed_files(session):
+    for info_id, file_id in session.info.pop("sent_files", ()):
+        file_index.put(info_id, file_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_files(session):
+    session.info.pop("sent_files", None)
+
+
+async def create_file(video_id: int, format_id: int, playlist_id: int = None, id_telegram: str = None,
+                      session: AsyncSession = None):
+    async with use_session(session) as session:
+        # Проверяем, есть ли уже файл с таким video_id и format_id
+        result = await session.execute(
+            select(File).filter(File.video_id == video_id, File.format_id == format_id)
+        )
+        existing_file = result.scalars().first()
+
+        if existing_file:
+            return existing_file.id_telegram  # Если файл есть, возвращаем его id_telegram
+
+        # Если файла нет, создаём новую запись
+        new_file = File(
+            video_id=video_id,
+            format_id=format_id,
+            playlist_id=playlist_id,
+            id_telegram=id_telegram
+        )
+        session.add(new_file)
+        await session.flush()  # Фиксируем ID нового объекта
+
+        if id_telegram:
+            # В индекс файл попадёт после коммита этой сессии — нашей или вызывающего; при откате не попадёт
+            session.info.setdefault("sent_files", []).append((format_id, id_telegram))
+    return id_telegram  # Возвращаем id_telegram нового файла
+async def add_file_to_playlist(file_id: int, playlist_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
+        file = await session.get(File, file_id)
+        if file:
+            file.playlist_id = playlist_id
+async def delete_file(file_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
+        file = await session.get(File, file_id)
+        if file:
+            await session.delete(file)
+async def get_file(file_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         return await session.get(File, file_id)
-async def get_telegram_id_by_format_id(format_id: int):
-    async with AsyncSessionLocal() as session:
+async def get_telegram_id_by_format_id(format_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(File.id_telegram).where(File.format_id == format_id)
         )
-        telegram_id = result.scalar_one_or_none()  # Получаем единственное значение или None
-        return telegram_id  # Вернет id_telegram или None, если записи нет
\ No newline at end of file
+        telegram_id = result.scalars().first()  # Файл может быть и в плейлистах — берём первый
+        return telegram_id  # Вернет id_telegram или None, если записи нет
+async def get_sent_files_batch(after_id: int, limit: int, session: AsyncSession = None):
+    """
+    Возвращает пачку отправленных файлов с File.id > after_id для прогрева индекса.
+
+    Returns:
+        list: Кортежи (File.id, Info.id, id_telegram), упорядоченные по File.id.
+    """
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(File.id, File.format_id, File.id_telegram)
+            .where(File.id > after_id, File.id_telegram.isnot(None))
+            .order_by(File.id)
+            .limit(limit)
+        )
+        return result.all()
+async def warm_file_index(batch_size: int = WARM_BATCH_SIZE):
+    """
+    Загружает в file_index все отправленные файлы пачками по batch_size строк.
+
+    Каждая пачка — отдельный короткий запрос с постраничной выборкой по File.id, между пачками
+    управление отдаётся event loop, поэтому бот отвечает пользователям, пока индекс прогревается.
+    """
+    started = time.monotonic()
+    last_id, total = 0, 0
+    while True:
+        rows = await get_sent_files_batch(after_id=last_id, limit=batch_size)
+        if not rows:
+            break
+        for file_row_id, info_id, file_id in rows:
+            file_index.put(info_id, file_id)
+        last_id = rows[-1][0]
+        total += len(rows)
+        await asyncio.sleep(0)
+    file_index.loaded = True
+    logging.info(f"Индекс файлов прогрет: {total} файлов за {time.monotonic() - started:.1f} с")
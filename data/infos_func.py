@@ -1,61 +1,95 @@
 from data.models import Info
-from database import AsyncSessionLocal
+from database import use_session, dialect_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 import re
 
 
-async def create_info(video_id: int, format_id: str, type: str = 'Video', resolution: str = None, size: str = None, status: bool = False):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            # Проверяем, есть ли уже такой объект Info
-            result = await session.execute(
-                select(Info).filter(Info.video_id == video_id, Info.format_id == format_id)
-            )
-            existing_info = result.scalars().first()
-
-            if existing_info:
-                return existing_info  # Если объект найден, возвращаем его
-
-            # Если объект не найден, создаём новый
-            new_info = Info(
-                video_id=video_id,
-                format_id=format_id,
-                type=type,
-                resolution=resolution,
-                size=size,
-                status=status
-            )
-            session.add(new_info)
-            await session.flush()  # Фиксируем новый объект перед коммитом
+async def create_info(video_id: int, format_id: str, type: str = 'Video', resolution: str = None, size: str = None, status: bool = False, session: AsyncSession = None):
+    async with use_session(session) as session:
+        # Проверяем, есть ли уже такой объект Info
+        result = await session.execute(
+            select(Info).filter(Info.video_id == video_id, Info.format_id == format_id)
+        )
+        existing_info = result.scalars().first()
+
+        if existing_info:
+            return existing_info  # Если объект найден, возвращаем его
+
+        # Если объект не найден, создаём новый
+        new_info = Info(
+            video_id=video_id,
+            format_id=format_id,
+            type=type,
+            resolution=resolution,
+            size=size,
+            status=status
+        )
+        session.add(new_info)
+        await session.flush()  # Фиксируем новый объект
+
+async def create_infos(video_id: int, formats: list, session: AsyncSession = None) -> dict:
+    """
+    Сохраняет все форматы видео одним запросом INSERT ... ON CONFLICT DO NOTHING.
+
+    Args:
+        video_id (int): ID видео в базе.
+        formats (list): Словари с ключами format_id, type, resolution, size.
+        session (AsyncSession): Сессия апдейта, если есть.
+
+    Returns:
+        dict: {format_id: id записи Info} — и для новых, и для уже существовавших форматов.
+    """
+    rows = {}
+    for f in formats:
+        rows.setdefault(f['format_id'], {
+            "video_id": video_id,
+            "format_id": f['format_id'],
+            "type": f.get('type', 'Video'),
+            "resolution": f.get('resolution'),
+            "size": f.get('size'),
+            "status": False,
+        })
+    if not rows:
+        return {}
+
+    async with use_session(session) as session:
+        await session.execute(
+            dialect_insert(Info).values(list(rows.values()))
+            .on_conflict_do_nothing(index_elements=[Info.video_id, Info.format_id])
+        )
+        # RETURNING не вернёт строки, пропущенные из-за конфликта, поэтому id дочитываем отдельно
+        result = await session.execute(
+            select(Info.format_id, Info.id)
+            .where(Info.video_id == video_id, Info.format_id.in_(list(rows)))
+        )
+        return dict(result.all())
 
-        await session.commit()
-async def get_info_by_video_id(video_id: int):
-    async with AsyncSessionLocal() as session:
+async def get_info_by_video_id(video_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(select(Info).where(Info.video_id == video_id))
         return result.scalars().all()
-async def get_status_by_id(info_id: int):
-    async with AsyncSessionLocal() as session:
+async def get_status_by_id(info_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(Info.status).where(Info.id == info_id)
         )
         status = result.scalar_one_or_none()  # Получаем единственное значение или None
         return status  # Вернет True / False / None, если записи нет
-async def update_info_status(id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(Info).where(Info.id == id)
-            )
-            info = result.scalars().first()
-
-            if info:
-                info.status = True
-                await session.commit()
-                return info  # Можно вернуть обновлённую запись
-            else:
-                return None  # Если ничего не найдено
-async def get_audio_info(video_id: int):
-    async with AsyncSessionLocal() as session:
+async def update_info_status(id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Info).where(Info.id == id)
+        )
+        info = result.scalars().first()
+
+        if info:
+            info.status = True
+            return info  # Можно вернуть обновлённую запись
+        else:
+            return None  # Если ничего не найдено
+async def get_audio_info(video_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(Info.format_id, Info.size)
             .where(Info.video_id == video_id)
@@ -67,8 +101,8 @@ async def get_audio_info(video_id: int):
             audio_id, audio_size = audio_info
             return audio_id, audio_size
         return None, None  # Если аудио не найдено
-async def get_video_formats(video_id: int):
-    async with AsyncSessionLocal() as session:
+async def get_video_formats(video_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(Info.format_id, Info.resolution, Info.size, Info.status)  # добавил Info.status
             .where(Info.video_id == video_id, Info.type == "Video")
@@ -91,8 +125,8 @@ async def get_video_formats(video_id: int):
         format_list.sort(key=lambda x: extract_width(x["resolution"]))
 
         return format_list  # Возвращаем отсортированный список
-async def get_formats_by_video_id(video_id: int):
-    async with AsyncSessionLocal() as session:
+async def get_formats_by_video_id(video_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(Info.format_id, Info.resolution, Info.size, Info.status, Info.type)
             .where(Info.video_id == video_id)
@@ -129,31 +163,36 @@ async def get_formats_by_video_id(video_id: int):
 
         # Объединяем, аудио первыми
         return audio_formats + video_formats
-async def get_info_id(video_id: int, format_id: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(Info.id)
-                .where(Info.video_id == video_id, Info.format_id == format_id)
-            )
-            info_id = result.scalars().first()  # Получаем id, если найдено
+async def get_info_id(video_id: int, format_id: str, session: AsyncSession = None):
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Info.id)
+            .where(Info.video_id == video_id, Info.format_id == format_id)
+        )
+        info_id = result.scalars().first()  # Получаем id, если найдено
 
-            return info_id
-async def get_format_id_by_id(info_id: int):
-    async with AsyncSessionLocal() as session:
+        return info_id
+async def get_format_info(info_id: int, session: AsyncSession = None):
+    """Возвращает (id, video_id, format_id, size, status) формата по id записи Info или None."""
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Info.id, Info.video_id, Info.format_id, Info.size, Info.status).where(Info.id == info_id)
+        )
+        return result.first()
+async def get_format_id_by_id(info_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(
             select(Info.format_id).where(Info.id == info_id)
         )
         format_id = result.scalar_one_or_none()
         return format_id  # Вернет строку или None, если записи нет
-async def get_info_by_video_and_format(video_id: int, format_id: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(Info).where(
-                    Info.video_id == video_id,
-                    Info.format_id == format_id
-                )
+async def get_info_by_video_and_format(video_id: int, format_id: str, session: AsyncSession = None):
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Info).where(
+                Info.video_id == video_id,
+                Info.format_id == format_id
             )
-            info_obj = result.scalars().first()  # Получаем сам объект Info
-            return info_obj
\ No newline at end of file
+        )
+        info_obj = result.scalars().first()  # Получаем сам объект Info
+        return info_obj
\ No newline at end of file
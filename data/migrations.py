@@ -0,0 +1,80 @@
+from sqlalchemy import inspect, text
+
+import logging
+
+
+# create_all не меняет уже созданные таблицы, поэтому индексы для существующих баз
+# досоздаются здесь один раз. Имена совпадают с теми, что объявлены в data/models.py.
+
+# Перед уникальным индексом по infos переносим файлы с дублей на самую раннюю запись формата и удаляем дубли
+DEDUPE_INFOS = [
+    "UPDATE files SET format_id = ("
+    " SELECT MIN(k.id) FROM infos d JOIN infos k"
+    " ON k.video_id = d.video_id AND k.format_id = d.format_id"
+    " WHERE d.id = files.format_id)"
+    " WHERE format_id IN ("
+    " SELECT d.id FROM infos d JOIN infos k"
+    " ON k.video_id = d.video_id AND k.format_id = d.format_id AND k.id < d.id)",
+    "DELETE FROM infos WHERE id IN ("
+    " SELECT d.id FROM infos d JOIN infos k"
+    " ON k.video_id = d.video_id AND k.format_id = d.format_id AND k.id < d.id)",
+]
+
+# Индексы под горячие запросы: (таблица, имя, определение)
+INDEXES = [
+    # is_video_in_db, get_video_by_url, create_video
+    ("videos", "ix_videos_url", "INDEX {concurrently} IF NOT EXISTS ix_videos_url ON videos (url)"),
+    # get_info_id, create_info(s), get_video_formats — префикс video_id покрывает и выборку всех форматов видео
+    ("infos", "uq_infos_video_format",
+     "UNIQUE INDEX {concurrently} IF NOT EXISTS uq_infos_video_format ON infos (video_id, format_id)"),
+    # get_telegram_id_by_format_id и create_file (format_id + video_id)
+    ("files", "ix_files_format_video", "INDEX {concurrently} IF NOT EXISTS ix_files_format_video ON files (format_id, video_id)"),
+]
+
+
+def _missing_indexes(sync_conn) -> list:
+    inspector = inspect(sync_conn)
+    existing = {}
+    for table, name, statement in INDEXES:
+        if table not in existing:
+            # uq_infos_video_format в новой базе — ограничение UNIQUE из модели, а не отдельный индекс
+            existing[table] = {index["name"] for index in inspector.get_indexes(table)}
+            existing[table] |= {constraint["name"] for constraint in inspector.get_unique_constraints(table)}
+    return [(name, statement) for table, name, statement in INDEXES if name not in existing[table]]
+
+
+async def run_migrations(engine):
+    """
+    Приводит схему существующей базы к data/models.py.
+
+    Миграция разовая: при запуске проверяется только наличие индексов, а дедупликация infos и построение
+    выполняются, лишь если индексов ещё нет. В PostgreSQL индексы строятся через CREATE INDEX CONCURRENTLY
+    вне транзакции, чтобы не блокировать запись в большие таблицы.
+
+    Args:
+        engine: AsyncEngine базы данных.
+    """
+    async with engine.connect() as conn:
+        missing = await conn.run_sync(_missing_indexes)
+    if not missing:
+        logging.info("Индексы базы данных уже созданы")
+        return
+
+    if any(name == "uq_infos_video_format" for name, _ in missing):
+        async with engine.begin() as conn:
+            for statement in DEDUPE_INFOS:
+                await conn.execute(text(statement))
+
+    if engine.dialect.name == "postgresql":
+        # CONCURRENTLY нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for name, statement in missing:
+                logging.info(f"Создаю индекс {name}")
+                await conn.execute(text("CREATE " + statement.format(concurrently="CONCURRENTLY")))
+    else:
+        async with engine.begin() as conn:
+            for name, statement in missing:
+                logging.info(f"Создаю индекс {name}")
+                await conn.execute(text("CREATE " + statement.format(concurrently="")))
+    logging.info("Индексы базы данных созданы")
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Boolean, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import engine  # Где создан SQLAlchemy engine
+from data.migrations import run_migrations
 
 Base = declarative_base()
 
@@ -70,7 +71,7 @@ class Video(Base):
     name = Column(String, nullable=True)
     author = Column(String, nullable=True)
     thumbnail = Column(String, nullable=True)
-    url = Column(String, nullable=False)
+    url = Column(String, nullable=False, index=True)
     channel_id = Column(String, ForeignKey('channels.channel_id', ondelete="CASCADE"), nullable=False)
     time = Column(BigInteger, nullable=True)
     date = Column(String, nullable=True)
@@ -80,6 +81,7 @@ class Video(Base):
 
 class Info(Base):
     __tablename__ = 'infos'
+    __table_args__ = (UniqueConstraint('video_id', 'format_id', name='uq_infos_video_format'),)
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     video_id = Column(BigInteger, ForeignKey('videos.id', ondelete="CASCADE"), nullable=False)
@@ -93,6 +95,7 @@ class Info(Base):
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (Index('ix_files_format_video', 'format_id', 'video_id'),)
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     video_id = Column(BigInteger, ForeignKey('videos.id'), nullable=False)
@@ -106,4 +109,7 @@ class File(Base):
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+    # Миграции управляют транзакциями сами: индексы в PostgreSQL строятся вне транзакции
+    await run_migrations(engine)
+
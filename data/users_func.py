@@ -1,112 +1,143 @@
 from data.models import User
-from database import AsyncSessionLocal
-from sqlalchemy.future import select
+from database import use_session, dialect_insert
+from config import COUNTER_FLUSH_INTERVAL
+from sqlalchemy import update, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 
-async def create_user(telegram_id: int, username: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            # Проверяем, есть ли уже пользователь с таким telegram_id
-            result = await session.execute(
-                select(User).filter(User.telegram_id == telegram_id)
-            )
-            existing_user = result.scalars().first()
-
-            if existing_user:
-                # Если пользователь существует, обновляем поле last_enter_date
-                existing_user.last_enter_date = datetime.utcnow()
-                # Возвращаем ID существующего пользователя
-                user_id = existing_user.telegram_id
-            else:
-                # Если пользователя нет, создаём нового
-                new_entry = User(
-                    telegram_id=telegram_id,
-                    username=username,
-                    login_time=datetime.utcnow(),
-                    last_enter_date=datetime.utcnow()
-                )
-                session.add(new_entry)
-                await session.commit()  # Коммитим добавление нового пользователя
-                # Возвращаем ID нового пользователя
-                user_id = new_entry.telegram_id
-
-        return user_id  # Возвращаем ID пользователя, который был либо создан, либо обновлен
-
-async def get_user(telegram_id: int):
-    async with AsyncSessionLocal() as session:
+import asyncio
+import logging
+
+
+COUNTER_COLUMNS = ("yt_count", "tt_count", "vk_count")
+
+
+async def create_user(telegram_id: int, username: str, session: AsyncSession = None):
+    async with use_session(session) as session:
+        now = datetime.utcnow()
+        # Один запрос: новый пользователь создаётся, у существующего обновляется last_enter_date
+        stmt = dialect_insert(User).values(
+            telegram_id=telegram_id,
+            username=username,
+            login_time=now,
+            last_enter_date=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={"last_enter_date": now}
+        ).returning(User.telegram_id)
+        result = await session.execute(stmt)
+        return result.scalar_one()  # Возвращаем ID пользователя, который был либо создан, либо обновлен
+
+async def get_user(telegram_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
         return await session.get(User, telegram_id)
 
-async def increment_tt_count(telegram_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if user:
-                # Если yt_count ещё не установлен — начинаем с 1
-                user.tt_count = (user.tt_count or 0) + 1
-                session.add(user)
-            else:
-                # Если пользователя нет, можно создать нового
-                new_user = User(
-                    telegram_id=telegram_id,
-                    tt_count=1
-                )
-                session.add(new_user)
-
-        await session.commit()
-
-async def increment_vk_count(telegram_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if user:
-                # Если yt_count ещё не установлен — начинаем с 1
-                user.vk_count = (user.vk_count or 0) + 1
-                session.add(user)
-            else:
-                # Если пользователя нет, можно создать нового
-                new_user = User(
-                    telegram_id=telegram_id,
-                    vk_count=1
-                )
-                session.add(new_user)
-
-        await session.commit()
-
-async def increment_yt_count(telegram_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
-
-            if user:
-                # Если yt_count ещё не установлен — начинаем с 1
-                user.yt_count = (user.yt_count or 0) + 1
-                session.add(user)
-            else:
-                # Если пользователя нет, можно создать нового
-                new_user = User(
-                    telegram_id=telegram_id,
-                    yt_count=1
-                )
-                session.add(new_user)
-
-        await session.commit()
-
-async def last_enter(telegram_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            user = await session.get(User, telegram_id)
-            if user:
-                user.last_enter_date = datetime.utcnow()
-                await session.commit()
+async def add_counters(rows: list, session: AsyncSession = None):
+    """
+    Атомарно прибавляет счётчики скачиваний одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Сложение выполняется на стороне базы (COALESCE(yt_count, 0) + n), поэтому параллельные
+    обновления не теряют инкременты. Отсутствующий пользователь создаётся с этими счётчиками.
+
+    Args:
+        rows (list): Словари {"telegram_id", "yt_count", "tt_count", "vk_count"} с приращениями.
+        session (AsyncSession): Сессия апдейта, если есть.
+    """
+    if not rows:
+        return
+    async with use_session(session) as session:
+        stmt = dialect_insert(User).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_={
+                column: func.coalesce(getattr(User, column), 0) + func.coalesce(getattr(stmt.excluded, column), 0)
+                for column in COUNTER_COLUMNS
+            }
+        )
+        await session.execute(stmt)
+
+
+class CounterBuffer:
+    """
+    Отложенная запись счётчиков скачиваний.
+
+    Инкременты копятся в памяти и раз в interval секунд уходят в базу одним запросом add_counters,
+    вместо отдельной транзакции на каждое скачивание. При остановке бота буфер сбрасывается.
+    """
+
+    def __init__(self, interval: float = COUNTER_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._task = None
+
+    def add(self, telegram_id: int, column: str, amount: int = 1):
+        counters = self._pending.setdefault(telegram_id, dict.fromkeys(COUNTER_COLUMNS, 0))
+        counters[column] += amount
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="counter-flush")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Не удалось записать счётчики скачиваний: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [{"telegram_id": telegram_id, **counters} for telegram_id, counters in pending.items()]
+        try:
+            await add_counters(rows)
+        except Exception:
+            # Возвращаем несохранённые инкременты, чтобы попробовать в следующий раз
+            for telegram_id, counters in pending.items():
+                for column, amount in counters.items():
+                    self._pending.setdefault(telegram_id, dict.fromkeys(COUNTER_COLUMNS, 0))[column] += amount
+            raise
+        logging.debug(f"Счётчики скачиваний записаны для {len(rows)} пользователей")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+counter_buffer = CounterBuffer()
+
+
+async def _increment(telegram_id: int, column: str, session: AsyncSession = None):
+    if counter_buffer.interval > 0:
+        counter_buffer.add(telegram_id, column)
+        return
+    async with use_session(session) as session:
+        result = await session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values({column: func.coalesce(getattr(User, column), 0) + 1})
+        )
+        if not result.rowcount:
+            # Если пользователя нет — создаём его со счётчиком 1
+            await add_counters([{"telegram_id": telegram_id, **dict.fromkeys(COUNTER_COLUMNS, 0), column: 1}],
+                               session=session)
+
+async def increment_tt_count(telegram_id: int, session: AsyncSession = None):
+    await _increment(telegram_id, "tt_count", session=session)
+
+async def increment_vk_count(telegram_id: int, session: AsyncSession = None):
+    await _increment(telegram_id, "vk_count", session=session)
+
+async def increment_yt_count(telegram_id: int, session: AsyncSession = None):
+    await _increment(telegram_id, "yt_count", session=session)
 
+async def last_enter(telegram_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values(last_enter_date=datetime.utcnow())
+        )
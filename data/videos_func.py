@@ -1,60 +1,134 @@
-from data.models import Video
-from database import AsyncSessionLocal
+from data.models import Video, Info, File
+from database import use_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import or_
+import re
 
 
 async def create_video(youtube_id: str, name: str, author: str, url: str, channel_id: str, time: str = None,
-                       date: str = None):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            # Проверяем, есть ли уже видео с таким URL
-            result = await session.execute(select(Video).filter(Video.url == url))
-            existing_video = result.scalars().first()
-
-            if existing_video:
-                return existing_video.id  # Если видео есть, возвращаем его ID
-
-            # Если видео нет, создаём новую запись
-            new_video = Video(
-                youtube_id=youtube_id,
-                name=name,
-                author=author,
-                url=url,
-                channel_id=channel_id,
-                time=time,
-                date=date
-            )
-            session.add(new_video)
-            await session.flush()  # Фиксируем ID нового объекта перед коммитом
-
-        await session.commit()
+                       date: str = None, session: AsyncSession = None):
+    async with use_session(session) as session:
+        # Проверяем, есть ли уже видео с таким ID или URL
+        result = await session.execute(select(Video).filter(or_(Video.youtube_id == youtube_id, Video.url == url)))
+        existing_video = result.scalars().first()
+
+        if existing_video:
+            return existing_video.id  # Если видео есть, возвращаем его ID
+
+        # Если видео нет, создаём новую запись
+        new_video = Video(
+            youtube_id=youtube_id,
+            name=name,
+            author=author,
+            url=url,
+            channel_id=channel_id,
+            time=time,
+            date=date
+        )
+        session.add(new_video)
+        await session.flush()  # Фиксируем ID нового объекта
+
         return new_video.id  # Возвращаем ID нового видео
-async def update_video_thumbnail(video_id: int, telegram_photo_id: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            result = await session.execute(select(Video).where(Video.id == video_id))
-            video = result.scalars().first()
-
-            if not video:
-                return False  # Видео не найдено
-
-            video.thumbnail = telegram_photo_id
-            await session.commit()
-            return True  # Успешное обновление
-async def get_video_by_url(url: str):
-    async with AsyncSessionLocal() as session:
+async def update_video_thumbnail(video_id: int, telegram_photo_id: str, session: AsyncSession = None):
+    async with use_session(session) as session:
+        result = await session.execute(select(Video).where(Video.id == video_id))
+        video = result.scalars().first()
+
+        if not video:
+            return False  # Видео не найдено
+
+        video.thumbnail = telegram_photo_id
+        return True  # Успешное обновление
+async def get_video_thumbnail(youtube_id: str, url: str, session: AsyncSession = None):
+    """
+    Возвращает Telegram file_id миниатюры, уже сохранённый для видео с таким ID или URL.
+
+    Args:
+        youtube_id (str): ID видео на платформе.
+        url (str): Ссылка на видео.
+        session (AsyncSession): Сессия базы данных или None.
+
+    Returns:
+        str | None: file_id фото из Video.thumbnail или None, если видео ещё не отправлялось.
+    """
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Video.thumbnail).filter(or_(Video.youtube_id == youtube_id, Video.url == url),
+                                           Video.thumbnail.isnot(None))
+        )
+        return result.scalars().first()
+async def get_video_by_url(url: str, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(select(Video).where(Video.url == url))
         return result.scalars().first()
-async def is_video_in_db(url: str) -> bool:
-    async with AsyncSessionLocal() as session:
+async def is_video_in_db(url: str, session: AsyncSession = None) -> bool:
+    async with use_session(session) as session:
         result = await session.execute(select(Video).where(Video.url == url))
         return result.scalars().first() is not None
-async def get_video_by_youtube_id(youtube_id: str):
-    async with AsyncSessionLocal() as session:
+def resolution_width(resolution) -> int:
+    # Ширина из "1920x1080" — первое число в строке
+    match = re.match(r"(\d+)", resolution or "")
+    return int(match.group(1)) if match else 0
+async def get_video_bundle(url: str, video_key: tuple = None, session: AsyncSession = None):
+    """
+    Одним запросом возвращает видео, все его форматы со статусом и Telegram file_id загруженных файлов.
+
+    Заменяет цепочку find_video + get_audio_info + get_video_formats + get_info_id/get_status_by_id
+    на каждую кнопку: при попадании в кэш клавиатура строится за один поход в базу.
+
+    Args:
+        url (str): Ссылка из сообщения.
+        video_key (tuple): Результат url_canon.resolve_video_key или None.
+        session (AsyncSession): Сессия апдейта, если есть.
+
+    Returns:
+        dict | None: {"video": Video, "audio": [...], "video_formats": [...]}, где каждый формат —
+        словарь с info_id, format_id, type, resolution, filesize, status, file_id.
+        Видеоформаты отсортированы по ширине кадра.
+    """
+    condition = Video.youtube_id == video_key[1] if video_key else Video.url == url
+    async with use_session(session) as session:
+        result = await session.execute(
+            select(Video, Info, File.id_telegram)
+            .outerjoin(Info, Info.video_id == Video.id)
+            .outerjoin(File, File.format_id == Info.id)
+            .where(condition)
+            .order_by(Info.id)
+        )
+        rows = result.all()
+
+    if not rows:
+        return None
+    formats = {}
+    for _, info, file_id in rows:
+        if info is None:
+            continue
+        item = formats.setdefault(info.id, {
+            "info_id": info.id,
+            "format_id": info.format_id,
+            "type": info.type,
+            "resolution": info.resolution,
+            "filesize": info.size,
+            "status": info.status,
+            "file_id": None,
+        })
+        # Один формат может быть в нескольких файлах (плейлисты) — берём первый непустой file_id
+        item["file_id"] = item["file_id"] or file_id
+
+    video_formats = [f for f in formats.values() if f["type"] != "Audio"]
+    video_formats.sort(key=lambda f: resolution_width(f["resolution"]))
+    return {
+        "video": rows[0][0],
+        "audio": [f for f in formats.values() if f["type"] == "Audio"],
+        "video_formats": video_formats,
+    }
+async def get_video_by_youtube_id(youtube_id: str, session: AsyncSession = None):
+    async with use_session(session) as session:
         result = await session.execute(select(Video).where(Video.youtube_id == youtube_id))
         return result.scalars().first()
-async def get_video(video_id: int):
-    async with AsyncSessionLocal() as session:  # ✅ Используем async with
-        result = await session.execute(select(Video).where(Video.id == video_id))  # ✅ Добавили await
+async def get_video(video_id: int, session: AsyncSession = None):
+    async with use_session(session) as session:
+        result = await session.execute(select(Video).where(Video.id == video_id))
         video = result.scalars().first()
-        return video
\ No newline at end of file
+        return video
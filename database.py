@@ -1,6 +1,8 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 
@@ -15,3 +17,29 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 engine = create_async_engine(DATABASE_URL, echo=True)
 AsyncSessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+
+@asynccontextmanager
+async def use_session(session: AsyncSession = None):
+    """
+    Возвращает сессию для функций из data/*_func.py.
+
+    Если вызывающий передал сессию (одна сессия на апдейт из DbSessionMiddleware), работаем в ней,
+    а коммит сделает её владелец. Иначе открываем собственную сессию с транзакцией, как раньше.
+    """
+    if session is not None:
+        yield session
+        return
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            yield session
+
+
+def dialect_insert(table):
+    """
+    Возвращает INSERT с поддержкой ON CONFLICT для диалекта текущей базы.
+
+    ON CONFLICT есть и в PostgreSQL, и в SQLite, но конструкция у каждого диалекта своя.
+    """
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
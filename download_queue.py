@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from config import DOWNLOAD_WORKERS, DOWNLOAD_PER_USER, FAST_SEND_WORKERS
+
+import itertools
+import asyncio
+import logging
+import time
+
+
+# Отдельный пул потоков для yt-dlp, чтобы загрузки не занимали стандартный пул asyncio.to_thread
+DOWNLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="download")
+
+# Приоритеты задач: чем меньше число, тем раньше задача будет взята воркером
+PRIORITY_CACHED = 0
+PRIORITY_AUDIO = 5
+PRIORITY_VIDEO = 10
+
+
+async def run_blocking(func, *args):
+    """
+    Выполняет блокирующую функцию загрузки в пуле DOWNLOAD_EXECUTOR.
+
+    Args:
+        func: Синхронная функция.
+        *args: Аргументы функции.
+
+    Returns:
+        Результат выполнения функции.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DOWNLOAD_EXECUTOR, func, *args)
+
+
+class DownloadQueue:
+    """
+    Планировщик загрузок с ограниченным числом воркеров.
+
+    Тяжёлые задачи (скачивание через yt-dlp + склейка ffmpeg) идут в общую очередь, которую
+    разбирают `workers` воркеров — это и есть глобальный лимит одновременных загрузок.
+    Кроме того, у каждого пользователя не больше `per_user` задач в очереди и в работе.
+    Отправка уже загруженных файлов (cache hit) идёт по отдельной быстрой полосе и никогда
+    не ждёт за длинными закачками.
+    """
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, per_user: int = DOWNLOAD_PER_USER,
+                 fast_workers: int = FAST_SEND_WORKERS):
+        self.workers = workers
+        self.per_user = per_user
+        self.fast_workers = fast_workers
+        self._queue = None
+        self._fast_queue = None
+        self._tasks = []
+        self._user_slots = {}
+        self._user_active = {}
+        self._counter = itertools.count()
+        self._running = 0
+        self._processed = 0
+        self._failed = 0
+        self._wait_times = deque(maxlen=500)
+
+    def _ensure_started(self):
+        # Воркеры создаются лениво, когда уже есть запущенный event loop
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._fast_queue = asyncio.PriorityQueue()
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(self._queue), name=f"download-worker-{i}"))
+        for i in range(self.fast_workers):
+            self._tasks.append(asyncio.create_task(self._worker(self._fast_queue), name=f"fast-send-worker-{i}"))
+        logging.info(f"Очередь загрузок запущена: {self.workers} воркеров, {self.fast_workers} быстрых, "
+                     f"лимит на пользователя {self.per_user}")
+
+    async def submit(self, user_id: int, func, *args, priority: int = PRIORITY_VIDEO, **kwargs):
+        """
+        Ставит задачу в очередь и ждёт её результата.
+
+        Args:
+            user_id (int): ID пользователя Telegram, для которого выполняется задача.
+            func: Асинхронная функция (например, download_and_merge_by_format).
+            *args: Аргументы функции.
+            priority (int): Приоритет; PRIORITY_CACHED отправляет задачу в быструю полосу.
+            **kwargs: Именованные аргументы функции.
+
+        Returns:
+            Результат выполнения func.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = (priority, next(self._counter), time.monotonic(), func, args, kwargs, future)
+
+        if priority == PRIORITY_CACHED:
+            await self._fast_queue.put(job)
+            return await future
+
+        # Семафор пользователя живёт, пока у него есть задачи в работе или в ожидании слота
+        slot, jobs = self._user_slots.get(user_id) or (asyncio.Semaphore(self.per_user), 0)
+        self._user_slots[user_id] = (slot, jobs + 1)
+        try:
+            async with slot:
+                self._user_active[user_id] = self._user_active.get(user_id, 0) + 1
+                try:
+                    await self._queue.put(job)
+                    return await future
+                finally:
+                    self._user_active[user_id] -= 1
+                    if not self._user_active[user_id]:
+                        del self._user_active[user_id]
+        finally:
+            slot, jobs = self._user_slots[user_id]
+            if jobs > 1:
+                self._user_slots[user_id] = (slot, jobs - 1)
+            else:
+                del self._user_slots[user_id]
+
+    async def _worker(self, queue: asyncio.PriorityQueue):
+        while True:
+            priority, _, enqueued_at, func, args, kwargs, future = await queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                wait = time.monotonic() - enqueued_at
+                self._wait_times.append(wait)
+                self._running += 1
+                logging.debug(f"Задача {getattr(func, '__name__', func)} взята в работу через {wait:.2f} с, "
+                              f"в очереди {self._queue.qsize()}")
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    self._failed += 1
+                    if not future.done():
+                        if isinstance(e, asyncio.CancelledError):
+                            future.cancel()
+                        else:
+                            future.set_exception(e)
+                    # Воркер продолжает работу, если только не отменяют его самого (остановка бота):
+                    # иначе каждая такая ошибка навсегда уменьшала бы число воркеров, а задача зависала
+                    if asyncio.current_task().cancelling():
+                        raise
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self._running -= 1
+                    self._processed += 1
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict:
+        """Возвращает метрики очереди: глубину, число задач в работе и время ожидания."""
+        waits = sorted(self._wait_times)
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "fast_queued": self._fast_queue.qsize() if self._fast_queue else 0,
+            "running": self._running,
+            "users": len(self._user_active),
+            "processed": self._processed,
+            "failed": self._failed,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+
+download_queue = DownloadQueue()
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict
+from config import EXTRACT_POOL, EXTRACT_WORKERS, EXTRACT_TIMEOUT
+from meta_cache import meta_cache, video_cache_key, VideoUnavailableError
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+import threading
+import asyncio
+import logging
+
+
+# Фразы в ошибках yt-dlp, после которых повторный запрос бессмысленен — такие видео кэшируем как недоступные
+UNAVAILABLE_MARKERS = (
+    "unavailable", "not available", "private", "removed", "blocked", "copyright",
+    "geo restrict", "sign in to confirm your age", "has been terminated",
+)
+
+
+class ExtractionError(Exception):
+    """Не удалось получить информацию о видео (сетевая ошибка, таймаут и т.п.)."""
+
+
+# YoutubeDL по одному на поток и набор настроек: экземпляр держит открытые соединения,
+# поэтому повторные запросы к тому же сайту не открывают новое TLS-соединение
+_local = threading.local()
+
+# Сколько наборов настроек держать в каждом потоке; вытесненный экземпляр закрывается вместе с соединениями
+MAX_YDL_PER_THREAD = 4
+
+
+def _get_ydl(ydl_opts: dict) -> YoutubeDL:
+    instances = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = OrderedDict()
+    key = repr(sorted(ydl_opts.items()))
+    ydl = instances.get(key)
+    if ydl is None:
+        ydl = instances[key] = YoutubeDL(ydl_opts)
+        while len(instances) > MAX_YDL_PER_THREAD:
+            _, old = instances.popitem(last=False)
+            old.close()
+    instances.move_to_end(key)
+    return ydl
+
+
+def extract_info_sync(url: str, ydl_opts: dict) -> dict:
+    """
+    Синхронно получает информацию о видео через yt-dlp. Выполняется в пуле потоков или процессов.
+
+    Args:
+        url (str): Ссылка на видео.
+        ydl_opts (dict): Настройки YoutubeDL.
+
+    Returns:
+        dict: Результат extract_info(download=False).
+
+    Raises:
+        VideoUnavailableError: Если видео удалено, приватное или заблокировано.
+        ExtractionError: При любой другой ошибке yt-dlp.
+    """
+    # Исключения yt-dlp плохо переживают pickle, поэтому из процесса отдаём свои простые исключения
+    try:
+        return _get_ydl(ydl_opts).extract_info(url, download=False)
+    except DownloadError as e:
+        if any(marker in str(e).lower() for marker in UNAVAILABLE_MARKERS):
+            raise VideoUnavailableError(str(e)) from None
+        raise ExtractionError(str(e)) from None
+
+
+class ExtractionService:
+    """
+    Выполняет блокирующие запросы (yt-dlp extract_info и т.п.) вне event loop.
+
+    Пул настраивается через EXTRACT_POOL: "thread" — пул потоков, "process" — пул процессов
+    (полезно, когда разбор страниц yt-dlp упирается в GIL). Каждый запрос ограничен таймаутом.
+    Кэш метаданных проверяется и пополняется в основном процессе, чтобы он был общим для всех воркеров.
+    """
+
+    def __init__(self, kind: str = EXTRACT_POOL, workers: int = EXTRACT_WORKERS, timeout: int = EXTRACT_TIMEOUT):
+        self.kind = kind
+        self.timeout = timeout
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+        # Прочие блокирующие вызовы (не pickle-совместимые) всегда идут в потоки
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blocking")
+
+    async def extract_info(self, url: str, ydl_opts: dict, timeout: int = None) -> dict:
+        """
+        Получает информацию о видео с учётом кэша, не блокируя event loop.
+
+        Args:
+            url (str): Ссылка на видео.
+            ydl_opts (dict): Настройки YoutubeDL.
+            timeout (int): Таймаут в секундах, по умолчанию EXTRACT_TIMEOUT.
+
+        Returns:
+            dict: Информация о видео.
+
+        Raises:
+            VideoUnavailableError: Если видео недоступно (в том числе по отрицательному кэшу).
+            ExtractionError: При ошибке или таймауте извлечения.
+        """
+        key = video_cache_key(url)
+        info = meta_cache.get(key)
+        if info is not None:
+            logging.debug(f"Метаданные {key} взяты из кэша")
+            return info
+
+        timeout = timeout or self.timeout
+        # Не даём сокету висеть дольше таймаута: сам поток yt-dlp прервать нельзя
+        ydl_opts = {'socket_timeout': timeout, **ydl_opts}
+        loop = asyncio.get_running_loop()
+        try:
+            info = await asyncio.wait_for(
+                loop.run_in_executor(self._executor, extract_info_sync, url, ydl_opts), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Таймаут {timeout} с при получении информации о {url}")
+            raise ExtractionError(f"Таймаут при получении информации о видео {url}")
+        except VideoUnavailableError as e:
+            meta_cache.put_negative(key, str(e))
+            raise
+
+        meta_cache.put(key, info)
+        return info
+
+    async def run(self, func, *args, timeout: int = None):
+        """
+        Выполняет произвольную блокирующую функцию в пуле потоков с таймаутом.
+
+        Args:
+            func: Синхронная функция.
+            *args: Аргументы функции.
+            timeout (int): Таймаут в секундах, по умолчанию EXTRACT_TIMEOUT.
+
+        Returns:
+            Результат выполнения функции.
+        """
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self._threads, func, *args), timeout or self.timeout)
+
+
+extractor = ExtractionService()
@@ -0,0 +1,207 @@
+from config import ffmpeg_path, FFMPEG_CONCURRENCY, FFMPEG_NICE, FFMPEG_IONICE
+
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import asyncio
+import shutil
+
+
+# Постпроцессоры yt-dlp, которые не запускают ffmpeg и не должны занимать слот
+NON_FFMPEG_POSTPROCESSORS = {"MoveFilesAfterDownload", "Exec", "MetadataParser", "XAttrMetadata", "SponsorBlock"}
+
+
+class FFmpegError(Exception):
+    """ffmpeg завершился с ненулевым кодом."""
+
+
+class PostprocessorSlots:
+    """
+    Hook для postprocessor_hooks yt-dlp: склейка и другие ffmpeg-постпроцессоры занимают общий слот FFmpegRunner.
+
+    Используется как контекстный менеджер вокруг загрузки: если постпроцессор упал и не прислал "finished",
+    слот освобождается при выходе.
+    """
+
+    def __init__(self, runner: "FFmpegRunner"):
+        self._runner = runner
+        self._held = 0
+
+    def __call__(self, d: dict):
+        if d.get("postprocessor") in NON_FFMPEG_POSTPROCESSORS:
+            return
+        if d.get("status") == "started":
+            self._runner._acquire_blocking()
+            self._held += 1
+        elif d.get("status") == "finished" and self._held:
+            self._held -= 1
+            self._runner._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        while self._held:
+            self._held -= 1
+            self._runner._release()
+
+
+class FFmpegRunner:
+    """
+    Единая точка запуска ffmpeg.
+
+    Все процессы ffmpeg бота — перекладка аудио, потоковая склейка и склейка внутри yt-dlp — используют
+    один путь к ffmpeg и один семафор на FFMPEG_CONCURRENCY слотов (по умолчанию по числу ядер), поэтому
+    параллельные загрузки не перегружают процессор. Процессы запускаются через asyncio с пониженным
+    приоритетом CPU и диска; при отмене задачи процесс убивается.
+    """
+
+    def __init__(self, binary: str = ffmpeg_path, concurrency: int = FFMPEG_CONCURRENCY, nice: int = FFMPEG_NICE,
+                 ionice: bool = FFMPEG_IONICE):
+        self.binary = binary
+        self.concurrency = max(concurrency, 1)
+        # Семафор потоковый: слоты берут и asyncio-задачи, и потоки загрузок yt-dlp
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        # Потоки, в которых asyncio-задачи ждут слот; очередь пула FIFO, поэтому слоты выдаются по порядку
+        self._waiters = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ffmpeg-slot")
+        self._lock = threading.Lock()
+        self._prefix = self._priority_prefix(nice, ionice)
+        self._processes = set()
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+
+    @staticmethod
+    def _priority_prefix(nice: int, ionice: bool) -> list:
+        prefix = []
+        if ionice and shutil.which("ionice"):
+            prefix += ["ionice", "-c", "3"]
+        if nice and shutil.which("nice"):
+            prefix += ["nice", "-n", str(nice)]
+        return prefix
+
+    def command(self, args: list) -> list:
+        """Собирает командную строку: приоритет, путь к ffmpeg, общие флаги и аргументы задачи."""
+        return [*self._prefix, self.binary, "-hide_banner", "-nostdin", "-loglevel", "error", *args]
+
+    def _acquire_blocking(self):
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+
+    async def _acquire(self):
+        # Семафор общий с потоками yt-dlp, поэтому ждём его в отдельном потоке, не блокируя event loop
+        acquired = asyncio.get_running_loop().run_in_executor(self._waiters, self._acquire_blocking)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Поток всё равно получит слот — возвращаем его сразу, как только получит
+            acquired.add_done_callback(self._release_acquired)
+            raise
+
+    def _release_acquired(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self.running -= 1
+        self._slots.release()
+
+    def postprocessor_hook(self) -> PostprocessorSlots:
+        """Hook для postprocessor_hooks yt-dlp; загрузку нужно обернуть в with hook."""
+        return PostprocessorSlots(self)
+
+    async def run(self, args: list, duration: float = None, on_progress=None):
+        """
+        Выполняет ffmpeg в общем слоте и ждёт завершения.
+
+        Прогресс читается из -progress pipe:1: после каждого блока вызывается on_progress(секунды, duration).
+
+        Args:
+            args (list): Аргументы ffmpeg (входы, параметры, выход).
+            duration (float): Длительность исходника в секундах, если известна.
+            on_progress: Функция on_progress(position, duration) или None.
+
+        Raises:
+            FFmpegError: Если ffmpeg завершился с ошибкой.
+            OSError: Если ffmpeg не удалось запустить.
+        """
+        await self._acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command(["-progress", "pipe:1", "-nostats", *args]),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            self._processes.add(process)
+            stderr_task = asyncio.create_task(process.stderr.read())
+            try:
+                progress = {}
+                async for line in process.stdout:
+                    key, _, value = line.decode(errors="ignore").strip().partition("=")
+                    progress[key] = value
+                    # Строка progress=continue|end закрывает очередной блок
+                    if key == "progress":
+                        out_time = progress.get("out_time_us", "")
+                        position = int(out_time) / 1_000_000 if out_time.isdigit() else 0.0
+                        if on_progress is not None:
+                            on_progress(position, duration)
+                returncode = await process.wait()
+                stderr = await stderr_task
+            except BaseException:
+                # Отменённая задача не должна оставлять ffmpeg работать в фоне
+                stderr_task.cancel()
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            finally:
+                self._processes.discard(process)
+        finally:
+            self._release()
+
+        if returncode != 0:
+            self.failed += 1
+            raise FFmpegError(f"ffmpeg завершился с кодом {returncode}: {stderr.decode(errors='ignore')[-500:]}")
+        self.completed += 1
+
+    async def spawn(self, args: list, **kwargs) -> asyncio.subprocess.Process:
+        """
+        Запускает ffmpeg с общим путём и приоритетом, но без слота.
+
+        Для копирования потоков в трубу (-c copy): такой процесс почти не тратит CPU, а живёт столько же,
+        сколько идёт отправка, и занятый им слот надолго задержал бы склейки. Вызывающий сам ждёт процесс.
+
+        Args:
+            args (list): Аргументы ffmpeg.
+            **kwargs: Параметры asyncio.create_subprocess_exec (stdout, stderr...).
+        """
+        process = await asyncio.create_subprocess_exec(*self.command(args), **kwargs)
+        self._processes = {p for p in self._processes if p.returncode is None}
+        self._processes.add(process)
+        return process
+
+    async def stop(self):
+        """Убивает запущенные процессы ffmpeg при остановке бота."""
+        for process in list(self._processes):
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        self._processes.clear()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "limit": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+ffmpeg_runner = FFmpegRunner()
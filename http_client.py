@@ -0,0 +1,54 @@
+from config import HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_KEEPALIVE
+
+import logging
+import aiohttp
+
+
+_session = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую HTTP-сессию для всех исходящих запросов бота.
+
+    Одна сессия держит пул keep-alive соединений, кэширует DNS и ограничивает число соединений
+    на хост, поэтому запросы к googleapis и ytimg не повторяют TLS-рукопожатие каждый раз.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_LIMIT,
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+        logging.info("Создана общая HTTP-сессия")
+    return _session
+
+
+async def get_json(url: str, params: dict = None) -> dict:
+    """
+    Выполняет GET-запрос через общую сессию и возвращает JSON.
+
+    Args:
+        url (str): Адрес запроса.
+        params (dict): Параметры строки запроса; значения None отбрасываются.
+
+    Returns:
+        dict: Ответ сервера.
+    """
+    session = await get_session()
+    params = {k: v for k, v in (params or {}).items() if v is not None}
+    async with session.get(url, params=params) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def close_session():
+    """Закрывает общую HTTP-сессию при остановке бота."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -7,6 +7,12 @@ from config import session
 from aiogram.fsm.storage.memory import MemoryStorage
 from data.models import init_db
 from app.keyboards import set_main_menu
+from http_client import close_session
+from data.users_func import counter_buffer
+from data.files_func import warm_file_index
+from config import WARM_FILE_INDEX
+from staging import staging
+from ffmpeg_runner import ffmpeg_runner
 
 
 # Логирование (чтобы видеть ошибки)
@@ -25,12 +31,23 @@ dp.include_router(router)
 
 async def main():
     print("Проверка: скрипт запустился!")
+    warm_task = None
     try:
         await init_db()
+        staging.start()
+        if WARM_FILE_INDEX:
+            # Индекс прогревается в фоне, бот начинает отвечать сразу
+            warm_task = asyncio.create_task(warm_file_index(), name="warm-file-index")
         await set_main_menu(bot)
         await dp.start_polling(bot, skip_updates=True, polling_timeout=120)
     except Exception as e:
         logging.error(f"Ошибка в боте: {e}")
+    finally:
+        if warm_task is not None and not warm_task.done():
+            warm_task.cancel()
+        await counter_buffer.stop()
+        await ffmpeg_runner.stop()
+        await close_session()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from config import META_CACHE_SIZE, META_CACHE_TTL, META_NEGATIVE_TTL, META_REUSE_FOR_DOWNLOAD
+from yt_dlp import YoutubeDL
+from url_canon import canonical_video
+
+import threading
+import logging
+import copy
+import time
+
+
+class VideoUnavailableError(Exception):
+    """Видео недоступно: удалено, приватное или заблокировано."""
+
+
+def video_cache_key(url: str) -> str:
+    """
+    Строит ключ кэша по ID видео, чтобы разные варианты одной ссылки попадали в одну запись.
+
+    Args:
+        url (str): Ссылка на видео.
+
+    Returns:
+        str: Ключ вида "youtube:<id>", "tiktok:<id>", "vk:<id>" или сама ссылка, если ID не распознан.
+    """
+    key = canonical_video(url)
+    if key:
+        return f"{key[0]}:{key[1]}"
+    return url
+
+
+class MetadataCache:
+    """
+    LRU-кэш результатов extract_info с временем жизни записей.
+
+    Хранит как успешные результаты, так и отрицательные (видео недоступно), чтобы повторные
+    ссылки на удалённые или заблокированные видео не ходили в сеть каждый раз.
+    Потокобезопасен: загрузки читают кэш из пула потоков.
+    """
+
+    def __init__(self, max_size: int = META_CACHE_SIZE, ttl: int = META_CACHE_TTL,
+                 negative_ttl: int = META_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """
+        Возвращает info из кэша или None.
+
+        Raises:
+            VideoUnavailableError: Если видео недавно было признано недоступным.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, info, error = item
+            if expires < time.monotonic():
+                del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        if error:
+            raise VideoUnavailableError(error)
+        return info
+
+    def put(self, key: str, info: dict):
+        self._store(key, (time.monotonic() + self.ttl, info, None))
+
+    def put_negative(self, key: str, error: str):
+        self._store(key, (time.monotonic() + self.negative_ttl, None, error))
+
+    def _store(self, key: str, item: tuple):
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+meta_cache = MetadataCache()
+
+
+def cached_info_for_download(url: str):
+    """
+    Возвращает копию закэшированного info для передачи в загрузку или None.
+
+    Плейлисты не возвращаются: загрузка всегда идёт по одному видео.
+    """
+    if not META_REUSE_FOR_DOWNLOAD:
+        return None
+    try:
+        info = meta_cache.get(video_cache_key(url))
+    except VideoUnavailableError:
+        return None
+    if not info or info.get("_type", "video") != "video":
+        return None
+    # process_ie_result изменяет словарь, поэтому отдаём копию
+    return copy.deepcopy(info)
+
+
+def download_with_info(ydl: YoutubeDL, url: str) -> dict:
+    """
+    Скачивает видео, используя закэшированный info, если он есть, иначе вызывает extract_info.
+
+    Args:
+        ydl (YoutubeDL): Настроенный экземпляр YoutubeDL.
+        url (str): Ссылка на видео.
+
+    Returns:
+        dict: Информация о скачанном видео.
+    """
+    info = cached_info_for_download(url)
+    if info is not None:
+        logging.debug(f"Загрузка {url} по закэшированному info без повторного extract_info")
+        return ydl.process_ie_result(info, download=True)
+    return ydl.extract_info(url, download=True)
@@ -26,7 +26,9 @@ def make_a_folders():
 
 
 def is_under_2gb(size_str):
-    match = re.search(r"([\d.]+)\s*(MB|GB)", size_str, re.IGNORECASE)  # Извлекаем число и единицу измерения
+    if isinstance(size_str, (int, float)):
+        return size_str >= 2048  # Число без единицы — мегабайты, как размеры TikTok в базе
+    match = re.search(r"([\d.]+)\s*(MB|GB)", str(size_str or ""), re.IGNORECASE)  # Извлекаем число и единицу измерения
     if not match:
         logging.debug(f'Не удалось проверить размер запрашиваемого файла')
         return False  # Если формат неправильный, возвращаем False
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+
+class SingleFlight:
+    """
+    Склеивает одновременные загрузки одного и того же файла.
+
+    Первый запрос по ключу (video_id, format_id) становится ведущим: он скачивает и отправляет файл,
+    а затем публикует полученный Telegram file_id через finish(). Остальные запросы с тем же ключом
+    ждут ведущего и переиспользуют его file_id вместо собственной загрузки.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    async def join(self, key) -> tuple:
+        """
+        Присоединяется к загрузке по ключу.
+
+        Args:
+            key: Ключ загрузки, обычно (video_id, format_id).
+
+        Returns:
+            tuple: (True, None), если вызывающий стал ведущим и должен скачать файл сам и вызвать finish();
+                   (False, file_id), если файл уже загрузил другой запрос.
+        """
+        while key in self._flights:
+            logging.info(f"Загрузка {key} уже выполняется, ожидаю результат")
+            # shield — чтобы отмена ожидающего не отменила future ведущего
+            file_id = await asyncio.shield(self._flights[key])
+            if file_id:
+                return False, file_id
+            # Ведущий завершился с ошибкой — пробуем сами, если никто не успел раньше
+        self._flights[key] = asyncio.get_running_loop().create_future()
+        return True, None
+
+    def finish(self, key, file_id: str = None):
+        """
+        Завершает загрузку ведущего и будит ожидающих.
+
+        Args:
+            key: Ключ загрузки.
+            file_id (str): Telegram file_id загруженного файла или None при ошибке.
+        """
+        future = self._flights.pop(key, None)
+        if future and not future.done():
+            future.set_result(file_id)
+
+    def in_flight(self) -> int:
+        """Возвращает число загрузок, выполняющихся прямо сейчас."""
+        return len(self._flights)
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,312 @@
+from config import (STAGING_BUDGET, STAGING_MIN_FREE, STAGING_RESERVE_FACTOR, STAGING_WAIT, STAGING_ORPHAN_AGE,
+                    STAGING_KEEP_SENT, STAGING_SWEEP_INTERVAL)
+from rest import DOWNLOAD_DIR
+
+import itertools
+import threading
+import tempfile
+import asyncio
+import logging
+import shutil
+import time
+import os
+import re
+
+
+# Размер по умолчанию, если у формата в базе нет размера
+DEFAULT_RESERVATION = 200 * 1024 * 1024
+
+
+class StagingFullError(Exception):
+    """На диске нет места под загрузку даже после ожидания."""
+
+
+def parse_size(size) -> int:
+    """
+    Переводит размер формата из базы ("12.5 MB", "1.2 GB", 3.2) в байты.
+
+    Размеры в базе хранятся в мегабайтах, поэтому число без единицы (старые записи TikTok) — тоже мегабайты.
+
+    Returns:
+        int: Размер в байтах или 0, если размер неизвестен.
+    """
+    if isinstance(size, (int, float)):
+        return int(size * 1024 ** 2)
+    match = re.search(r"([\d.]+)\s*(KB|MB|GB)?", str(size or ""), re.IGNORECASE)
+    if not match:
+        return 0
+    unit = (match.group(2) or "MB").upper()
+    return int(float(match.group(1)) * {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}[unit])
+
+
+# Имя итогового файла внутри папки задачи: название видео, обрезанное по байтам, чтобы не упереться в лимит ФС
+JOB_OUTTMPL = "%(title).100B.%(ext)s"
+
+
+class JobOutput:
+    """
+    Запоминает путь к итоговому файлу загрузки из postprocessor_hooks yt-dlp.
+
+    Путь берётся у yt-dlp после склейки и переноса файла, а не собирается заново по шаблону имени.
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def __call__(self, d: dict):
+        if d.get("status") == "finished":
+            self.path = d.get("info_dict", {}).get("filepath") or self.path
+
+    def resolve(self, info: dict):
+        """
+        Возвращает путь к скачанному файлу.
+
+        Args:
+            info (dict): Результат extract_info/process_ie_result с download=True.
+
+        Returns:
+            str | None: Путь к существующему файлу или None.
+        """
+        candidates = [self.path] + [d.get("filepath") for d in reversed(info.get("requested_downloads") or [])]
+        return next((path for path in candidates if path and os.path.exists(path)), None)
+
+
+class StagingArea:
+    """
+    Учёт места на диске под временные файлы загрузок в DOWNLOAD_DIR.
+
+    Перед скачиванием задача резервирует место по размеру формата из базы (с запасом на
+    промежуточные файлы yt-dlp). Если бюджет исчерпан, задача ждёт освобождения места, а через
+    STAGING_WAIT секунд получает отказ. Каждая загрузка пишет файлы в собственную папку задачи, поэтому
+    параллельные загрузки разных форматов одного видео не пересекаются по именам. Фоновая уборка удаляет брошенные файлы (.part, .webm и т.п.
+    после сбоев) старше STAGING_ORPHAN_AGE и отправленные файлы, которые держали для повторной отправки.
+    """
+
+    def __init__(self, root: str = DOWNLOAD_DIR, budget: int = STAGING_BUDGET, min_free: int = STAGING_MIN_FREE,
+                 reserve_factor: float = STAGING_RESERVE_FACTOR, wait: float = STAGING_WAIT,
+                 orphan_age: float = STAGING_ORPHAN_AGE, keep_sent: float = STAGING_KEEP_SENT):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.reserve_factor = reserve_factor
+        self.wait = wait
+        self.orphan_age = orphan_age
+        self.keep_sent = keep_sent
+        self._reservations = {}
+        self._ids = itertools.count(1)
+        self._kept = {}
+        self._lock = threading.Lock()
+        self._changed = None
+        self._task = None
+        self.refused = 0
+
+    @property
+    def reserved(self) -> int:
+        return sum(self._reservations.values())
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.reserved + nbytes > self.budget:
+            return False
+        # Бюджет может быть больше реально свободного места — проверяем и диск
+        free = shutil.disk_usage(self.root).free
+        return free - nbytes >= self.min_free
+
+    async def reserve(self, size) -> int:
+        """
+        Резервирует место под загрузку; ждёт, если места нет.
+
+        Args:
+            size: Размер формата из базы (строка вида "12.5 MB" или число байт).
+
+        Returns:
+            int: ID резерва для release().
+
+        Raises:
+            StagingFullError: Если места не появилось за STAGING_WAIT секунд.
+        """
+        self._ensure_started()
+        nbytes = int((parse_size(size) or DEFAULT_RESERVATION) * self.reserve_factor)
+        if nbytes > self.budget:
+            self.refused += 1
+            raise StagingFullError(f"Загрузке нужно {nbytes // 1024 ** 2} MB, бюджет {self.budget // 1024 ** 2} MB")
+
+        deadline = time.monotonic() + self.wait
+        async with self._changed:
+            while not self._fits(nbytes):
+                # Сначала пробуем освободить место за счёт файлов, хранимых для повторной отправки;
+                # удаление папок — в потоке, чтобы не блокировать event loop
+                if await asyncio.to_thread(self._evict_kept):
+                    continue
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    self.refused += 1
+                    raise StagingFullError(f"Нет места на диске под {nbytes // 1024 ** 2} MB")
+                logging.info(f"Нет места под загрузку {nbytes // 1024 ** 2} MB, жду освобождения")
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            reservation = next(self._ids)
+            self._reservations[reservation] = nbytes
+        return reservation
+
+    def release(self, reservation: int = None):
+        """Снимает резерв после того, как файл отправлен или загрузка не удалась."""
+        if reservation is None or self._reservations.pop(reservation, None) is None:
+            return
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def job_dir(self, key: str) -> str:
+        """
+        Создаёт папку под одну загрузку внутри DOWNLOAD_DIR.
+
+        Если файл того же видео и формата ещё хранится после отправки (STAGING_KEEP_SENT), отдаётся его папка:
+        yt-dlp увидит готовый файл и не будет качать заново.
+
+        Args:
+            key (str): ID видео и формата, например "42-137".
+
+        Returns:
+            str: Путь к папке задачи.
+        """
+        prefix = re.sub(r"[^\w-]", "_", key)[:40] + "-"
+        with self._lock:
+            for path in list(self._kept):
+                folder = os.path.dirname(path)
+                if os.path.basename(folder).startswith(prefix) and os.path.isdir(folder):
+                    del self._kept[path]
+                    # Свежая отметка времени, чтобы уборка не приняла папку за брошенную
+                    os.utime(folder)
+                    return folder
+        return tempfile.mkdtemp(prefix=prefix, dir=self.root)
+
+    def remove_job(self, folder: str):
+        """Удаляет папку задачи вместе с недокачанными и промежуточными файлами."""
+        if not folder or os.path.abspath(os.path.dirname(folder)) != os.path.abspath(self.root):
+            return
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def discard(self, path: str, keep: bool = True):
+        """
+        Убирает отправленный файл: удаляет сразу или, если включено STAGING_KEEP_SENT, оставляет на время.
+
+        Оставленный файл yt-dlp найдёт на диске и не станет качать повторно, если отправку придётся повторить.
+        """
+        if not path or not os.path.exists(path):
+            return
+        if keep and self.keep_sent > 0:
+            with self._lock:
+                self._kept[path] = time.monotonic()
+            return
+        self._remove(path)
+
+    def _remove(self, path: str, kept_at: float = None) -> bool:
+        with self._lock:
+            if kept_at is not None and self._kept.get(path) != kept_at:
+                # Пока решали удалить, файл забрала новая загрузка (job_dir) — его папка уже в работе
+                return False
+            self._kept.pop(path, None)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            logging.info(f"Файл {path} УДАЛЕН!")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Не удалось удалить {path}: {e}")
+        # Файл лежит в папке задачи — удаляем её вместе с остатками промежуточных файлов
+        self.remove_job(os.path.dirname(path))
+        return True
+
+    def _evict_kept(self) -> bool:
+        # Самый давно отправленный файл из хранимых — первый кандидат на удаление
+        with self._lock:
+            if not self._kept:
+                return False
+            oldest = min(self._kept, key=self._kept.get)
+            kept_at = self._kept[oldest]
+        # Если файл успела забрать загрузка, просто пробуем снова со следующим
+        self._remove(oldest, kept_at)
+        return True
+
+    def sweep(self, startup: bool = False):
+        """
+        Удаляет брошенные файлы и истёкшие хранимые.
+
+        Args:
+            startup (bool): При старте бота активных загрузок нет, поэтому удаляется всё независимо от возраста.
+        """
+        now_mono, now = time.monotonic(), time.time()
+        # Уборка идёт в отдельном потоке, а хранимые файлы меняются из event loop — работаем со снимком
+        with self._lock:
+            kept = dict(self._kept)
+        for path, kept_at in kept.items():
+            if now_mono - kept_at > self.keep_sent:
+                self._remove(path, kept_at)
+
+        removed = 0
+        with self._lock:
+            kept = set(self._kept)
+        kept_dirs = {os.path.dirname(path) for path in kept}
+        for entry in os.scandir(self.root):
+            if entry.path in kept or entry.path in kept_dirs:
+                continue
+            try:
+                age = now - self._last_modified(entry)
+            except FileNotFoundError:
+                continue
+            # Во время работы файлы активной загрузки постоянно обновляются, старые папки и файлы — брошенные
+            if startup or age > self.orphan_age:
+                self._remove(entry.path)
+                removed += 1
+        if removed:
+            logging.info(f"Уборка {self.root}: удалено брошенных файлов {removed}")
+
+    @staticmethod
+    def _last_modified(entry: os.DirEntry) -> float:
+        if not entry.is_dir():
+            return entry.stat().st_mtime
+        mtimes = [entry.stat().st_mtime]
+        for root, _, files in os.walk(entry.path):
+            mtimes += [os.stat(os.path.join(root, name)).st_mtime for name in files]
+        return max(mtimes)
+
+    def _ensure_started(self):
+        if self._task is not None:
+            return
+        self._changed = asyncio.Condition()
+        self._task = asyncio.create_task(self._sweeper(), name="staging-sweeper")
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(STAGING_SWEEP_INTERVAL)
+            try:
+                # scandir, stat и rmtree блокируют, поэтому уборка идёт в отдельном потоке
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logging.error(f"Ошибка уборки {self.root}: {e}")
+            await self._notify()
+
+    def start(self):
+        """Убирает мусор, оставшийся после прошлого запуска, и запускает фоновую уборку."""
+        self.sweep(startup=True)
+        self._ensure_started()
+
+    def stats(self) -> dict:
+        usage = shutil.disk_usage(self.root)
+        return {
+            "reserved": self.reserved,
+            "active": len(self._reservations),
+            "kept": len(self._kept),
+            "free": usage.free,
+            "refused": self.refused,
+        }
+
+
+staging = StagingArea()
@@ -0,0 +1,139 @@
+from aiogram import Bot
+from config import STREAM_CHUNK_SIZE, STREAM_UPLOAD, session as api_session
+from ffmpeg_runner import ffmpeg_runner
+from http_client import get_session
+from meta_cache import cached_info_for_download
+from extractor import extractor
+from yt_dlp import YoutubeDL
+
+from urllib.parse import urlparse
+
+import asyncio
+import logging
+import aiohttp
+
+
+# Лимит Telegram на размер файла через локальный Bot API
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+
+# Отправляем в свой сервер Bot API из config.session, а не в сервер бота: публичный api.telegram.org
+# принимает от ботов файлы только до 50 МБ, и большие видео всегда уходили бы обратно на диск
+UPLOAD_API = api_session.api
+STREAM_ENABLED = STREAM_UPLOAD and urlparse(UPLOAD_API.base).hostname != "api.telegram.org"
+if STREAM_UPLOAD and not STREAM_ENABLED:
+    logging.warning("STREAM_UPLOAD выключен: потоковая отправка работает только через свой сервер Bot API")
+
+# Фрагментированный MP4 можно писать в трубу: moov в начале, дальше самостоятельные фрагменты
+FRAGMENTED_MP4_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+
+class StreamUploadError(Exception):
+    """Потоковая отправка не удалась, нужно качать файл на диск обычным способом."""
+
+
+def _resolve_formats(url: str, format_id: str) -> dict:
+    # Только выбор форматов и прямые ссылки, без скачивания
+    ydl_opts = {
+        'cookiefile': "cookies.txt",
+        'quiet': True,
+        'format': f"{format_id}+bestaudio/best",
+        'socket_timeout': 60,
+        'extractor_args': {
+            'youtube': {
+                'formats': 'missing_pot'
+            }
+        }
+    }
+    with YoutubeDL(ydl_opts) as ydl:
+        info = cached_info_for_download(url)
+        if info is not None:
+            return ydl.process_ie_result(info, download=False)
+        return ydl.extract_info(url, download=False)
+
+
+def _ffmpeg_args(requested: list) -> list:
+    command = []
+    for f in requested:
+        headers = "".join(f"{k}: {v}\r\n" for k, v in (f.get("http_headers") or {}).items())
+        if headers:
+            command += ["-headers", headers]
+        command += ["-i", f["url"]]
+    if len(requested) > 1:
+        command += ["-map", "0:v:0", "-map", "1:a:0"]
+    command += ["-c", "copy", "-movflags", FRAGMENTED_MP4_FLAGS, "-f", "mp4", "pipe:1"]
+    return command
+
+
+async def stream_video_to_chat(bot: Bot, video, format_id: str, chat_id: int, caption: str):
+    """
+    Склеивает видео и аудио через ffmpeg прямо в multipart-запрос sendVideo, минуя папку videos.
+
+    yt-dlp только выбирает форматы и отдаёт прямые ссылки, ffmpeg пишет фрагментированный MP4 в stdout,
+    а тело запроса к Bot API читается из этой трубы по мере склейки. Файл целиком на диск не пишется.
+
+    Args:
+        bot (Bot): Экземпляр бота — из него берутся адрес Bot API и токен.
+        video: Запись Video из базы.
+        format_id (str): ID выбранного видеоформата.
+        chat_id (int): Куда отправлять.
+        caption (str): Подпись к видео.
+
+    Returns:
+        str: Telegram file_id отправленного видео.
+
+    Raises:
+        StreamUploadError: Если склейка или отправка не удалась.
+    """
+    info = await extractor.run(_resolve_formats, video.url, format_id)
+    requested = info.get("requested_formats") or [info]
+    if any(not f.get("url") or f.get("protocol", "https").startswith("m3u8") for f in requested):
+        raise StreamUploadError("формат недоступен по прямой ссылке")
+
+    # Только копирование потоков, поэтому без слота ffmpeg_runner: процесс живёт всё время отправки
+    process = await ffmpeg_runner.spawn(
+        _ffmpeg_args(requested),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    sent = 0
+
+    async def body():
+        nonlocal sent
+        while True:
+            chunk = await process.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            sent += len(chunk)
+            if sent > MAX_UPLOAD_SIZE:
+                raise StreamUploadError("файл больше 2 ГБ")
+            yield chunk
+        # Ошибка ffmpeg должна оборвать запрос, иначе Telegram получит обрезанный файл
+        if await process.wait() != 0:
+            stderr = await process.stderr.read()
+            raise StreamUploadError(f"ffmpeg завершился с кодом {process.returncode}: {stderr.decode(errors='ignore')[-500:]}")
+
+    with aiohttp.MultipartWriter("form-data") as form:
+        for name, value in (("chat_id", chat_id), ("caption", caption), ("supports_streaming", "true")):
+            part = form.append(str(value))
+            part.set_content_disposition("form-data", name=name)
+        part = form.append(aiohttp.payload.AsyncIterablePayload(body()), {"Content-Type": "video/mp4"})
+        part.set_content_disposition("form-data", name="video", filename=f"{video.id}-{format_id}.mp4")
+
+    session = await get_session()
+    url = UPLOAD_API.api_url(token=bot.token, method="sendVideo")
+    try:
+        async with session.post(url, data=form, timeout=aiohttp.ClientTimeout(total=None, sock_read=900)) as response:
+            result = await response.json()
+    except Exception as e:
+        raise StreamUploadError(f"отправка прервана: {e}") from e
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    if not result.get("ok"):
+        raise StreamUploadError(result.get("description", "Bot API вернул ошибку"))
+    message = result["result"]
+    media = message.get("video") or message.get("document")
+    logging.info(f"УСПЕХ: Видео {video.id} ({format_id}) отправлено потоком, {sent / (1024 ** 2):.1f} MB")
+    return media["file_id"]
@@ -1,6 +1,10 @@
-from rest import DOWNLOAD_DIR, EMOJIS
+from rest import EMOJIS
+from download_queue import run_blocking
+from meta_cache import download_with_info
+from extractor import extractor
+from staging import staging, JobOutput, JOB_OUTTMPL
+from ffmpeg_runner import ffmpeg_runner
 from yt_dlp import YoutubeDL
-import asyncio
 import emoji
 import os
 
@@ -12,44 +16,49 @@ async def get_tiktok_video_info(url):
         'extract_flat': False,  # Позволяет получить детали о видео
     }
 
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)  # Только получаем данные, без скачивания
-        video_id = info.get("id", "Неизвестно")
-        title = info.get("title", "Без названия")
-        author = (info.get("uploader") if info.get("uploader") != "Неизвестно" else info.get("uploader_id", "Неизвестно"))
-        channel_id = info.get("channel_id", "Неизвестно")
-        duration = info.get("duration", 0)
-        upload_date = info.get("upload_date", "Нет данных")
-        thumbnail_url = info.get("thumbnail", "Неизвестно")
+    info = await extractor.extract_info(url, ydl_opts)  # Только получаем данные, без скачивания
+    video_id = info.get("id", "Неизвестно")
+    title = info.get("title", "Без названия")
+    author = (info.get("uploader") if info.get("uploader") != "Неизвестно" else info.get("uploader_id", "Неизвестно"))
+    channel_id = info.get("channel_id", "Неизвестно")
+    duration = info.get("duration", 0)
+    upload_date = info.get("upload_date", "Нет данных")
+    thumbnail_url = info.get("thumbnail", "Неизвестно")
 
     return info, video_id, title, author, channel_id, duration, upload_date, thumbnail_url
 
 async def download_tiktok_video(video, format_id):
     def sync_download():
         url = video.url
-        title = video.name
         video_id = video.id
+        job_dir = staging.job_dir(f"{video_id}-{format_id}")
+        output = JobOutput()
+        ffmpeg_slots = ffmpeg_runner.postprocessor_hook()
 
         ydl_opts = {
             'format': f'{format_id}+ba/best',  # Выбирает лучшее видео+аудио
-            'outtmpl': os.path.join(DOWNLOAD_DIR, f"{title}_%(resolution)s{video_id}.%(ext)s"),  # Формат имени файла
+            'outtmpl': os.path.join(job_dir, JOB_OUTTMPL),  # Формат имени файла
+            'postprocessor_hooks': [output, ffmpeg_slots],  # Путь к итоговому файлу и слот для склейки
+            'ffmpeg_location': ffmpeg_runner.binary,
             'merge_output_format': 'mp4',  # Принудительное объединение в MP4
             'quiet': False,  # Выводит процесс загрузки
             'noplaylist': True,  # Загружает только одно видео
         }
 
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)  # Загружаем видео
-                resolution = info.get('resolution', 'unknow')
-                ext = info.get('ext', 'mp4')  # Если не найдено расширение, по умолчанию 'mkv'
-                file_path = os.path.join(DOWNLOAD_DIR, f"{title}_{resolution}{video_id}.{ext}")
-                return file_path, info if os.path.exists(file_path) else None
+            with ffmpeg_slots, YoutubeDL(ydl_opts) as ydl:
+                info = download_with_info(ydl, url)  # Загружаем видео
         except Exception as e:
             print(f"Ошибка при скачивании: {e}")
-            return None
+            staging.remove_job(job_dir)
+            return None, None
+        file_path = output.resolve(info)
+        if not file_path:
+            staging.remove_job(job_dir)
+            return None, None
+        return file_path, info
     # Запускаем синхронную загрузку в отдельном потоке
-    return await asyncio.to_thread(sync_download)
+    return await run_blocking(sync_download)
 
 async def get_tiktok_video_details(info):
     """Возвращает список словарей с форматами видео, исключая дубликаты разрешений"""
@@ -68,8 +77,9 @@ async def get_tiktok_video_details(info):
                 if resolution not in formats or size_mb > formats[resolution][1]:
                     formats[resolution] = (format_id, size_mb)
 
-    # Преобразуем в список словарей
-    result = [{"format_id": fmt_id, "resolution": res, "filesize": size} for res, (fmt_id, size) in formats.items()]
+    # Преобразуем в список словарей; размер с единицей, как у YouTube и VK ("12.5 MB"), 0 — размер неизвестен
+    result = [{"format_id": fmt_id, "resolution": res, "filesize": f"{size} MB" if size else 0}
+              for res, (fmt_id, size) in formats.items()]
 
     return result
 
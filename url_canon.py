@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from http_client import get_session
+from urllib.parse import urlsplit, parse_qs
+
+import logging
+import re
+
+
+YOUTUBE_HOSTS = ("youtube.com", "youtu.be", "youtube-nocookie.com")
+# youtube.com/shorts/ID, /embed/ID, /live/ID, /v/ID
+YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{11})(?:/|$)")
+# youtu.be/ID
+YOUTU_BE_PATH_RE = re.compile(r"^/([\w-]{11})(?:/|$)")
+TIKTOK_VIDEO_RE = re.compile(r"/video/(\d+)")
+# Короткие ссылки TikTok: vm.tiktok.com/XXXX, vt.tiktok.com/XXXX, tiktok.com/t/XXXX
+TIKTOK_SHORT_RE = re.compile(r"^(?:https?://)?(?:vm|vt)\.tiktok\.com/\w+|tiktok\.com/t/\w+", re.IGNORECASE)
+VK_VIDEO_RE = re.compile(r"video(-?\d+_\d+)")
+
+# Сколько раскрытых коротких ссылок держим в памяти
+SHORT_LINKS_CACHE_SIZE = 5000
+
+_short_links = OrderedDict()
+
+
+def _split(url: str):
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    return (parts.hostname or "").lower(), parts
+
+
+def canonical_video(url: str):
+    """
+    Приводит ссылку на видео к ключу (платформа, ID видео) без обращения к сети и базе.
+
+    Все варианты одной ссылки (youtu.be, m.youtube.com, shorts, параметры t= и si= и т.п.)
+    дают один и тот же ключ.
+
+    Args:
+        url (str): Ссылка на видео.
+
+    Returns:
+        tuple | None: ("youtube" | "tiktok" | "vk", ID видео) или None, если ID не распознан.
+    """
+    host, parts = _split(url.strip())
+    if any(host == h or host.endswith("." + h) for h in YOUTUBE_HOSTS):
+        video_id = parse_qs(parts.query).get("v", [None])[0]
+        if not video_id:
+            match = (YOUTU_BE_PATH_RE if host == "youtu.be" else YOUTUBE_PATH_RE).match(parts.path)
+            video_id = match.group(1) if match else None
+        if video_id and re.fullmatch(r"[\w-]{11}", video_id):
+            return "youtube", video_id
+        return None
+    if host == "tiktok.com" or host.endswith(".tiktok.com"):
+        match = TIKTOK_VIDEO_RE.search(parts.path)
+        return ("tiktok", match.group(1)) if match else None
+    if host in ("vk.com", "m.vk.com", "vkvideo.ru", "m.vkvideo.ru", "vk.ru"):
+        # Видео может быть и в пути, и в параметре z= (video-123_456/pl_...)
+        match = VK_VIDEO_RE.search(parts.path) or VK_VIDEO_RE.search(parts.query)
+        return ("vk", match.group(1)) if match else None
+    return None
+
+
+def canonical_url(platform: str, video_id: str) -> str:
+    """Возвращает каноническую ссылку на видео по ключу из canonical_video."""
+    if platform == "youtube":
+        return f"https://www.youtube.com/watch?v={video_id}"
+    if platform == "tiktok":
+        return f"https://www.tiktok.com/@/video/{video_id}"
+    return f"https://vk.com/video{video_id}"
+
+
+async def resolve_video_key(url: str):
+    """
+    Как canonical_video, но дополнительно раскрывает короткие ссылки TikTok (vm.tiktok.com).
+
+    Редирект запрашивается один раз, результат кэшируется в памяти.
+
+    Args:
+        url (str): Ссылка на видео.
+
+    Returns:
+        tuple | None: (платформа, ID видео) или None.
+    """
+    key = canonical_video(url)
+    if key or not TIKTOK_SHORT_RE.search(url):
+        return key
+
+    url = url.strip()
+    if url in _short_links:
+        _short_links.move_to_end(url)
+        return _short_links[url]
+    try:
+        session = await get_session()
+        async with session.head(url if "://" in url else "https://" + url, allow_redirects=True) as response:
+            key = canonical_video(str(response.url))
+    except Exception as e:
+        logging.warning(f"Не удалось раскрыть короткую ссылку {url}: {e}")
+        return None
+    if key:
+        _short_links[url] = key
+        while len(_short_links) > SHORT_LINKS_CACHE_SIZE:
+            _short_links.popitem(last=False)
+    return key
@@ -1,12 +1,14 @@
 from yt_dlp import YoutubeDL
 from typing import Tuple, Optional
 import os
-import asyncio
 import re
 
 from sqlalchemy.orm import Session
-from config import ffmpeg_path
-from rest import DOWNLOAD_DIR
+from download_queue import run_blocking
+from meta_cache import download_with_info, VideoUnavailableError
+from extractor import extractor
+from staging import staging, JobOutput, JOB_OUTTMPL
+from ffmpeg_runner import ffmpeg_runner
 
 
 async def get_vk_video_info(url: str) -> Tuple[dict, str, str, str, Optional[int], str, str]:
@@ -24,28 +26,29 @@ async def get_vk_video_info(url: str) -> Tuple[dict, str, str, str, Optional[int
     match = re.search(r'video(-?\d+_\d+)', url)
     target_video_id = match.group(1) if match else None
 
-    with YoutubeDL(ydl_opts) as ydl:
-        try:
-            info = ydl.extract_info(url, download=False)
-
-            # Если это плейлист — ищем нужное видео
-            if info.get('_type') == 'playlist':
-                entries = info.get('entries', [])
-                if not entries:
-                    raise ValueError("Плейлист пуст")
-
-                # Ищем по ID
-                if target_video_id:
-                    for entry in entries:
-                        if entry.get('id') == target_video_id:
-                            info = entry
-                            break
-                    else:
-                        raise ValueError(f"Видео с ID {target_video_id} не найдено в плейлисте")
+    try:
+        info = await extractor.extract_info(url, ydl_opts)
+
+        # Если это плейлист — ищем нужное видео
+        if info.get('_type') == 'playlist':
+            entries = info.get('entries', [])
+            if not entries:
+                raise ValueError("Плейлист пуст")
+
+            # Ищем по ID
+            if target_video_id:
+                for entry in entries:
+                    if entry.get('id') == target_video_id:
+                        info = entry
+                        break
                 else:
-                    info = entries[0]  # запасной вариант
-        except Exception as e:
-            raise RuntimeError(f"Не удалось получить информацию о видео: {e}")
+                    raise ValueError(f"Видео с ID {target_video_id} не найдено в плейлисте")
+            else:
+                info = entries[0]  # запасной вариант
+    except VideoUnavailableError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Не удалось получить информацию о видео: {e}")
 
     duration = info.get('duration')
     author = info.get('uploader', 'Неизвестно')
@@ -145,7 +148,7 @@ async def get_formats_vk_video(video_info):
     return result
 
 
-async def download_vk_video_async(video, format_id):
+async def download_vk_video_async(video, format_id, audio_only: bool = False):
     """
     Асинхронно загружает видео с VK с помощью yt-dlp.
 
@@ -153,6 +156,7 @@ async def download_vk_video_async(video, format_id):
         db (Session): Сессия базы данных для получения данных пользователя.
         user_id (int): ID пользователя, который запросил скачивание.
         format_id (str): Идентификатор формата видео.
+        audio_only (bool): Качать только аудиодорожку, без видеопотока.
 
     Returns:
         tuple[str, dict] | None:
@@ -162,22 +166,22 @@ async def download_vk_video_async(video, format_id):
     """
 
     def sync_download():
-        ffmpeg_path = os.path.abspath("ffmpeg/bin/ffmpeg.exe")
-        os.environ["PATH"] += os.pathsep + os.path.dirname(ffmpeg_path)
         url = video.url
-        title = video.name
         video_id = video.id
-
+        job_dir = staging.job_dir(f"{video_id}-{format_id}")
+        output = JobOutput()
+        ffmpeg_slots = ffmpeg_runner.postprocessor_hook()
 
         ydl_opts = {
-            'format': f'{format_id}+ba/best',
-            'outtmpl': os.path.join(DOWNLOAD_DIR, f"{title}_{video_id}.%(ext)s"),
+            'format': f'{format_id}/ba' if audio_only else f'{format_id}+ba/best',
+            'outtmpl': os.path.join(job_dir, JOB_OUTTMPL),
+            'postprocessor_hooks': [output, ffmpeg_slots],
             'merge_output_format': 'mp4',
             'quiet': True,
             'noplaylist': True,
             'http_chunk_size': 2097152,  # 2MB
             'concurrent-fragments': 15,  # 10 потоков
-            'ffmpeg_location': '/usr/bin/ffmpeg',
+            'ffmpeg_location': ffmpeg_runner.binary,
             'http_headers': {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
                 'Referer': 'https://vk.com',
@@ -185,16 +189,19 @@ async def download_vk_video_async(video, format_id):
         }
 
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)  # Скачиваем видео
-                ext = info.get('ext', 'mp4')  # Определяем расширение файла
-                file_path = os.path.join(DOWNLOAD_DIR, f"{title}_{video_id}.{ext}")
-                return file_path, info if os.path.exists(file_path) else None
+            with ffmpeg_slots, YoutubeDL(ydl_opts) as ydl:
+                info = download_with_info(ydl, url)  # Скачиваем видео
         except Exception as e:
             print(f"Ошибка при скачивании: {e}")
-            return None
+            staging.remove_job(job_dir)
+            return None, None
+        file_path = output.resolve(info)
+        if not file_path:
+            staging.remove_job(job_dir)
+            return None, None
+        return file_path, info
 
     # Запускаем синхронную загрузку в отдельном потоке
-    return await asyncio.to_thread(sync_download)
+    return await run_blocking(sync_download)
 
 
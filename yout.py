@@ -1,11 +1,12 @@
 from sqlalchemy.orm import Session
-from config import ffmpeg_path
-from rest import DOWNLOAD_DIR
+from download_queue import run_blocking
+from meta_cache import download_with_info
+from extractor import extractor
+from staging import staging, JobOutput, JOB_OUTTMPL
+from ffmpeg_runner import ffmpeg_runner, FFmpegError
 from yt_dlp import YoutubeDL
 
 
-import subprocess
-import asyncio
 import logging
 import os
 import re
@@ -45,18 +46,22 @@ async def download_and_merge_by_format(video, format_id: str) -> str:
     """
 
     def sync_download():
-        os.environ["PATH"] += os.pathsep + os.path.dirname(ffmpeg_path)
         url = video.url
-        title = video.name
         video_id = video.id
+        # Своя папка на каждую загрузку: имена файлов разных форматов одного видео не пересекаются
+        job_dir = staging.job_dir(f"{video_id}-{format_id}")
+        output = JobOutput()
+        # Склейка ffmpeg внутри yt-dlp занимает общий слот ffmpeg_runner
+        ffmpeg_slots = ffmpeg_runner.postprocessor_hook()
         # Настройки для скачивания видео и аудио
         ydl_opts = {
             'cookiefile': "cookies.txt",
             'verbose': True,
             'format': f"{format_id}+bestaudio/best",
             'merge_output_format': 'mp4',
-            'outtmpl': os.path.join(DOWNLOAD_DIR, f"{title}-%(resolution)s{video_id}.%(ext)s"),  # Имя файлов
-            'ffmpeg_location': ffmpeg_path,
+            'outtmpl': os.path.join(job_dir, JOB_OUTTMPL),  # Имя файлов
+            'postprocessor_hooks': [output, ffmpeg_slots],
+            'ffmpeg_location': ffmpeg_runner.binary,
             'socket_timeout': 60,
             'retries': 5,
             'nocheckcertificate': True,
@@ -73,18 +78,18 @@ async def download_and_merge_by_format(video, format_id: str) -> str:
         # Скачивание видео и аудио
 
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                resolution = info.get('resolution', 'unknown')
-                ext = info.get('ext', 'mp4')
+            with ffmpeg_slots, YoutubeDL(ydl_opts) as ydl:
+                info = download_with_info(ydl, url)
         except Exception as e:
             logging.error(f"❌ Ошибка при скачивании видео: {e}", exc_info=True)  # <-- Выводим всю инфу об ошибке
+            staging.remove_job(job_dir)
             return None, f'Ошибка: {e}'
 
         # Проверяем, что формат существует
         formats = info.get("formats", [])
         format_info = next((f for f in formats if f["format_id"] == format_id), None)
         if not format_info:
+            staging.remove_job(job_dir)
             raise ValueError(f"Формат с ID {format_id} не найден.")
 
         # Формируем результат
@@ -103,14 +108,81 @@ async def download_and_merge_by_format(video, format_id: str) -> str:
             "filesize": format_info.get("filesize", "Нет данных"),
         }
 
-        output_file = os.path.join(DOWNLOAD_DIR, f"{title}-{resolution}{video_id}.{ext}")
-        # Проверяем, что файл существует
-        file_abs = os.path.abspath(output_file)
-        if not file_abs or not os.path.exists(file_abs):
-            raise FileNotFoundError(f"Файл {file_abs} не найден.")
+        # Путь к итоговому файлу сообщает сам yt-dlp после склейки
+        output_file = output.resolve(info)
+        if not output_file:
+            staging.remove_job(job_dir)
+            raise FileNotFoundError(f"yt-dlp не сообщил путь к файлу в {job_dir}.")
         return output_file, video_info
 
-    return await asyncio.to_thread(sync_download)
+    return await run_blocking(sync_download)
+
+
+async def download_audio_by_format(video, format_id: str) -> tuple:
+    """
+    Скачивает только аудиодорожку и перекладывает её в m4a без перекодирования.
+
+    Args:
+        video: Запись Video из базы.
+        format_id (str): ID аудиоформата.
+
+    Returns:
+        tuple: Путь к аудиофайлу и информация о видео; (None, текст ошибки), если скачать не удалось.
+    """
+
+    def sync_download():
+        job_dir = staging.job_dir(f"{video.id}-{format_id}")
+        output = JobOutput()
+        ffmpeg_slots = ffmpeg_runner.postprocessor_hook()
+        ydl_opts = {
+            'cookiefile': "cookies.txt",
+            'quiet': True,
+            # Только аудио: видеопоток не качается и не склеивается
+            'format': f"{format_id}/bestaudio",
+            'outtmpl': os.path.join(job_dir, JOB_OUTTMPL),
+            'postprocessor_hooks': [output, ffmpeg_slots],
+            'ffmpeg_location': ffmpeg_runner.binary,
+            'socket_timeout': 60,
+            'retries': 5,
+            'nocheckcertificate': True,
+            'extractor_args': {
+                'youtube': {
+                    'formats': 'missing_pot'
+                }
+            }
+        }
+        try:
+            with ffmpeg_slots, YoutubeDL(ydl_opts) as ydl:
+                info = download_with_info(ydl, video.url)
+        except Exception as e:
+            logging.error(f"❌ Ошибка при скачивании аудио: {e}", exc_info=True)
+            staging.remove_job(job_dir)
+            return None, f'Ошибка: {e}'
+
+        output_file = output.resolve(info)
+        if not output_file:
+            staging.remove_job(job_dir)
+            raise FileNotFoundError(f"yt-dlp не сообщил путь к файлу в {job_dir}.")
+        video_info = {
+            "title": info.get("title", "Без названия"),
+            "uploader": info.get("uploader", "Неизвестен"),
+            "view_count": info.get("view_count", "Нет данных"),
+            "duration": info.get("duration", 0),
+            "upload_date": info.get("upload_date", "Нет данных"),
+            "thumbnail": info.get("thumbnail", ""),
+            "format_id": info.get("format_id"),
+            "extension": info.get("ext"),
+            "resolution": "audio only",
+            "vcodec": "none",
+            "acodec": info.get("acodec", "Нет данных"),
+            "filesize": info.get("filesize", "Нет данных"),
+        }
+        return output_file, video_info
+
+    output_file, video_info = await run_blocking(sync_download)
+    if output_file:
+        output_file = await remux_audio(output_file, video_info["acodec"])
+    return output_file, video_info
 
 
 async def get_video_info(url):
@@ -143,38 +215,38 @@ async def get_video_info(url):
         }
     }
 
-    with YoutubeDL(ydl_opts) as ydl:
-
-        info = ydl.extract_info(url, download=False)
+    info = await extractor.extract_info(url, ydl_opts)
 
-        # id видео
-        video_id = info.get("id", "Неизвестно")
+    # id видео
+    video_id = info.get("id", "Неизвестно")
 
-        # Название видео
-        title = info.get('title', 'Без названия')
+    # Название видео
+    title = info.get('title', 'Без названия')
 
-        # Миниатюра
-        thumbnail = info.get('thumbnail', '')
-        print(thumbnail)
-        print(type(thumbnail))
-        channel_id = info.get("channel_id", "ID не найден")
-        channel_name = info.get("channel", "Название не найдено")
+    # Миниатюра
+    thumbnail = info.get('thumbnail', '')
+    print(thumbnail)
+    print(type(thumbnail))
+    channel_id = info.get("channel_id", "ID не найден")
+    channel_name = info.get("channel", "Название не найдено")
 
-        # Проверяем наличие аудиоформатов
-        formats = info.get('formats', [])
-        audio_formats = [
-            f for f in formats
-            if f.get("acodec") != "none" and f.get("vcodec") == "none" and f.get("filesize")
-        ]
+    # Проверяем наличие аудиоформатов
+    formats = info.get('formats', [])
+    audio_formats = [
+        f for f in formats
+        if f.get("acodec") != "none" and f.get("vcodec") == "none" and f.get("filesize")
+    ]
 
-        # Ищем аудиоформат с максимальным размером файла
-        if audio_formats:
-            best_audio = max(audio_formats, key=lambda f: f['filesize'])
+    # Ищем аудиоформат с максимальным размером файла; AAC в приоритете — его Telegram показывает как музыку
+    # и отправляется он без ffmpeg, Opus берём, только если AAC нет
+    aac_formats = [f for f in audio_formats if (f.get("acodec") or "").startswith("mp4a")]
+    if audio_formats:
+        best_audio = max(aac_formats or audio_formats, key=lambda f: f['filesize'])
 
-        # with open("video_info.json", "w", encoding="utf-8") as f:
-        #     json.dump(info, f, indent=4, ensure_ascii=False)
+    # with open("video_info.json", "w", encoding="utf-8") as f:
+    #     json.dump(info, f, indent=4, ensure_ascii=False)
 
-        return best_audio['format_id'], best_audio['filesize'], title, thumbnail, info, video_id, channel_id, channel_name
+    return best_audio['format_id'], best_audio['filesize'], title, thumbnail, info, video_id, channel_id, channel_name
 
 
 async def filter_best_formats(formats, video_id):
@@ -207,37 +279,71 @@ async def filter_best_formats(formats, video_id):
     return list(best_formats.values())
 
 
-async def convert_webm_to_m4a(input_file: str) -> str:
+# Контейнер под аудиокодек: дорожка копируется без перекодирования. Telegram показывает как музыку
+# только MP3 и M4A, поэтому Opus тоже кладём в m4a (MP4 поддерживает Opus); Vorbis в MP4 не бывает
+AUDIO_CONTAINERS = {
+    "mp4a": "m4a",
+    "aac": "m4a",
+    "opus": "m4a",
+    "vorbis": "ogg",
+}
+
+
+def audio_container(acodec: str, ext: str) -> str:
     """
-    Конвертирует webm в m4a, удаляет исходный файл и возвращает путь к новому файлу.
+    Подбирает расширение, в которое аудиодорожку можно переложить без перекодирования.
 
     Args:
-        input_file (str): Путь к входному .webm файлу.
+        acodec (str): Кодек из yt-dlp ("opus", "mp4a.40.2" и т.п.).
+        ext (str): Текущее расширение файла.
 
     Returns:
-        str: Путь к сконвертированному .m4a файлу.
+        str: "m4a", "ogg" (только Vorbis) или текущее расширение, если кодек неизвестен.
     """
-    if not input_file.lower().endswith(".webm"):
-        raise ValueError("Файл должен быть в формате .webm")
-        return
+    codec = (acodec or "").split(".")[0].lower()
+    if codec in AUDIO_CONTAINERS:
+        return AUDIO_CONTAINERS[codec]
+    # Кодек неизвестен — угадываем по контейнеру: в webm сейчас почти всегда Opus
+    return {"webm": "m4a", "mp4": "m4a"}.get(ext, ext)
 
-    # Формируем путь к выходному файлу
-    output_file = input_file.rsplit(".", 1)[0] + ".m4a"
 
-    # Формируем команду ffmpeg
-    command = ["ffmpeg", "-i", input_file, "-vn", "-y", output_file]
+async def remux_audio(input_file: str, acodec: str = None) -> str:
+    """
+    Перекладывает аудиодорожку (AAC или Opus) в m4a без перекодирования.
 
-    try:
-        # Запускаем процесс конвертации
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ffmpeg запускается через ffmpeg_runner с -c:a copy, поэтому не блокирует event loop и
+    не нагружает процессор кодированием. Исходный файл удаляется.
 
-        # Удаляем исходный файл .webm
-        os.remove(input_file)
+    Args:
+        input_file (str): Путь к скачанному аудиофайлу (.webm, .m4a, .mp4 ...).
+        acodec (str): Кодек дорожки из yt-dlp, если известен.
 
-        return output_file
-    except subprocess.CalledProcessError as e:
-        print(f"Ошибка при конвертации: {e}")
-        return ""
+    Returns:
+        str: Путь к итоговому файлу. Если контейнер уже подходящий или ffmpeg не справился — исходный путь.
+    """
+    base, ext = os.path.splitext(input_file)
+    ext = ext.lstrip(".").lower()
+    target = audio_container(acodec, ext)
+    if target == ext:
+        return input_file
+
+    output_file = f"{base}.{target}"
+    args = ["-y", "-i", input_file, "-vn", "-c:a", "copy"]
+    if target == "m4a":
+        # moov в начале файла — Telegram сразу показывает длительность и начинает воспроизведение
+        args += ["-movflags", "+faststart"]
+    args.append(output_file)
+
+    try:
+        await ffmpeg_runner.run(args)
+    except (FFmpegError, OSError) as e:
+        logging.warning(f"Не удалось переложить {input_file} в {target}: {e}")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return input_file
+
+    os.remove(input_file)
+    return output_file
 
 
 async def filter_unique_formats(formats):